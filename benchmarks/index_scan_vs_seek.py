@@ -0,0 +1,89 @@
+import random
+import sys
+import os
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text, insert
+from sqlalchemy.engine import Engine
+
+from database.db import Base
+from database.models import Level, LikeUsers, ClearedUsers
+
+'''
+Scan versus seek latency of the level lookups covered by the secondary indexes,
+on two in-memory SQLite databases seeded with the same levels, one without and one with the indexes.
+
+    python benchmarks/index_scan_vs_seek.py [levels]
+'''
+
+LEVELS: int = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+USERS: int = 5000
+LOOKUPS: int = 200
+
+QUERIES: dict[str, str] = {
+    'level by level_id': 'SELECT * FROM level_table WHERE level_id = :level_id',
+    'levels by author': 'SELECT * FROM level_table WHERE author_id = :user_id ORDER BY id DESC LIMIT 10',
+    'featured page': 'SELECT * FROM level_table WHERE featured = 1 AND testing_client = 0 ORDER BY id DESC LIMIT 10',
+    'like probe': 'SELECT * FROM likes_table WHERE parent_id = :parent_id AND user_id = :user_id',
+    'clear probe': 'SELECT * FROM clears_table WHERE parent_id = :parent_id AND user_id = :user_id',
+}
+
+
+def level_id(n: int) -> str:
+    digits = f'{n * 2654435761 % 16 ** 16:016X}'
+    return '-'.join(digits[i:i + 4] for i in range(0, 16, 4))
+
+
+def seed(indexed: bool) -> Engine:
+    engine = create_engine('sqlite://')
+    rng = random.Random(0)
+    with engine.begin() as conn:
+        Base.metadata.create_all(conn)
+        if not indexed:
+            for table in Base.metadata.sorted_tables:
+                for index in table.indexes:
+                    index.drop(conn)
+        conn.execute(insert(Level), [{
+            'id': n, 'name': f'Level {n}', 'likes': 0, 'dislikes': 0, 'plays': 0, 'deaths': 0, 'clears': 0,
+            'style': 0, 'environment': 0, 'tag_1': 0, 'tag_2': 0, 'description': '', 'author_id': n % USERS,
+            'level_id': level_id(n), 'non_latin': False, 'featured': n % 50 == 0, 'record_user_id': 0,
+            'record': 0, 'testing_client': False
+        } for n in range(1, LEVELS + 1)])
+        for model in (LikeUsers, ClearedUsers):
+            conn.execute(insert(model), [
+                {'parent_id': rng.randint(1, LEVELS), 'user_id': rng.randrange(USERS)} for _ in range(LEVELS)
+            ])
+    return engine
+
+
+def measure(engine: Engine, sql: str) -> tuple[float, str]:
+    # mean seconds per lookup, and the query plan
+    rng = random.Random(1)
+    with engine.connect() as conn:
+        params = [{
+            'level_id': level_id(rng.randint(1, LEVELS)),
+            'user_id': rng.randrange(USERS),
+            'parent_id': rng.randint(1, LEVELS)
+        } for _ in range(LOOKUPS)]
+        plan = '; '.join(row[-1] for row in conn.execute(text(f'EXPLAIN QUERY PLAN {sql}'), params[0]))
+        start = perf_counter()
+        for param in params:
+            conn.execute(text(sql), param).all()
+        return (perf_counter() - start) / LOOKUPS, plan
+
+
+def main():
+    print(f'Seeding {LEVELS} levels...')
+    engines = {'scan': seed(indexed=False), 'seek': seed(indexed=True)}
+    for name, sql in QUERIES.items():
+        results = {kind: measure(engine, sql) for kind, engine in engines.items()}
+        scan, seek = results['scan'][0], results['seek'][0]
+        print(f'{name}: scan {scan * 1e6:.0f} us, seek {seek * 1e6:.0f} us ({scan / seek:.0f}x)')
+        for kind, (_, plan) in results.items():
+            print(f'    {kind}: {plan}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+import os
+import sys
+import timeit
+from time import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from session.session_access import generate_session_id
+
+'''
+Throughput of session id generation, against the old user id + unix time ids.
+
+    python benchmarks/session_ids.py [count]
+'''
+
+COUNT: int = int(sys.argv[1]) if len(sys.argv) > 1 else 10 ** 6
+
+
+def old_session_id(user_id: int = 123) -> str:
+    return f'{user_id}{int(time())}'
+
+
+def main():
+    for name, generator in (('random 48-bit', generate_session_id), ('user id + time', old_session_id)):
+        seconds: float = min(timeit.repeat(generator, number=COUNT, repeat=3))
+        print(f'{name}: {seconds / COUNT * 1e9:.0f} ns per id, {COUNT / seconds / 1e6:.1f} M ids/s')
+    ids = {generate_session_id() for _ in range(COUNT)}
+    print(f'{COUNT - len(ids)} repeated ids among {COUNT}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+import base64
+import os
+import pickle
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from level_file import prepare_level
+
+'''
+Peak memory of the upload path for a .swe right under and one over the 4MB limit,
+rejecting the oversized one before or after it is prepared.
+Accepted uploads also pickle the .swe and the level ids, as they are sent to and from an ingest worker.
+
+    python benchmarks/upload_peak_memory.py [MB over the limit]
+'''
+
+LIMIT: int = 4 * 1024 * 1024
+OVERSIZE: int = int(float(sys.argv[1]) * 1024 * 1024) if len(sys.argv) > 1 else 4 * 1024 * 1024
+
+
+def make_swe(size: int) -> str:
+    # base64 level data followed by a 40 character checksum
+    level_data: bytes = b'{"objects": [' + b'1,' * ((size * 3 // 4 - 64) // 2) + b'0], "time": "0"}'
+    return base64.b64encode(level_data).decode() + 'C' * 40
+
+
+def early_check(swe: str):
+    if len(swe) > LIMIT:
+        return None
+    return prepare_level(swe)
+
+
+def late_check(swe: str):
+    level_file = prepare_level(swe)
+    if len(level_file.payload) > LIMIT:
+        return None
+    return level_file
+
+
+def accepted(swe: str):
+    level_file = early_check(swe)
+    return pickle.loads(pickle.dumps(swe)), pickle.loads(pickle.dumps(level_file.level_ids)), level_file
+
+
+def peak(function, swe: str) -> int:
+    tracemalloc.start()
+    try:
+        function(swe)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    small, large = make_swe(LIMIT - 1024), make_swe(LIMIT + OVERSIZE)
+    print(f'.swe sizes: accepted {len(small) / 2 ** 20:.1f} MB, rejected {len(large) / 2 ** 20:.1f} MB')
+    for name, function, swe in (
+            ('reject, check before prepare_level', early_check, large),
+            ('reject, check after prepare_level', late_check, large),
+            ('accept, prepare_level and worker transfer', accepted, small),
+    ):
+        print(f'{name}: peak {peak(function, swe) / 2 ** 20:.2f} MB')
+
+
+if __name__ == '__main__':
+    main()
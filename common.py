@@ -1,16 +1,27 @@
 import base64
 from dataclasses import dataclass
 from enum import Enum
+from collections import OrderedDict
+from functools import lru_cache
 import hashlib
 import re
 
+from fastapi.responses import Response
 from xpinyin import Pinyin
+import orjson
 
 from locales import *
 
 from database.models import Level
+from database.db_access import LevelHydration
 
-from models import LevelDetails, LevelDetailsUserData
+from config import SEARCH_FRAGMENT_CACHE_SIZE
+
+
+_level_fragments: OrderedDict[tuple, 'LevelFragment'] = OrderedDict()  # LRU of rendered levels
+# loading the Pinyin dictionary is expensive, share one converter per process
+_pinyin = Pinyin()
+_latinify_table = {ord(f): ord(t) for f, t in zip(u'，。！？【】（）％＃＠＆－—〔〕：；〇﹒—﹙﹚、—“”', u',.!?[]()%#@&--():;0.—(),-""')}
 
 
 class ClientType(Enum):
@@ -30,16 +41,39 @@ class AuthCodeData:
     testing_client: bool
 
 
-def level_to_details(level_data: Level, locale: str, level_file_url: str, mobile: bool, like_type: str,
-                     clear_type: str,
-                     author: str, record_user: str):
+@dataclass
+class LevelFragment:
+    # Pre-rendered JSON of a level, split around user_data which is the only per-user part
+    head: bytes  # {"name": ... "featured": 0
+    tail: bytes  # "record": ... "id": "..."}
+
+    def render(self, completed: str, liked: str) -> bytes:
+        return self.head + b',"user_data":' + orjson.dumps({'completed': completed, 'liked': liked}) + b',' + self.tail
+
+
+def level_to_fragment(level_data: Level, locale: str, level_file_url: str, mobile: bool,
+                      hydration: LevelHydration) -> LevelFragment:
+    author_name: str = hydration.author_name(level_data.author_id)
+    record_user_name: str = hydration.record_user_name(level_data.record_user_id)
+    # everything the fragment shows besides columns that never change after upload
+    fragment_key: tuple = (
+        level_data.id, locale, mobile, level_file_url, author_name, record_user_name,
+        level_data.likes, level_data.dislikes, level_data.plays, level_data.deaths, level_data.clears,
+        level_data.featured, level_data.record_user_id, level_data.record
+    )
+    fragment: LevelFragment | None = _level_fragments.get(fragment_key)
+    if fragment is not None:
+        _level_fragments.move_to_end(fragment_key)
+        return fragment
+
     if mobile and level_data.non_latin:
-        name: str = string_latinify(level_data.name)
+        # precomputed at upload, levels not yet backfilled fall back to the cached converter
+        name: str = level_data.name_latin if level_data.name_latin is not None else string_latinify(level_data.name)
     else:
         name: str = level_data.name
     if level_data.record != 0:
         record = {'record': 'yes',
-                  'alias': record_user,
+                  'alias': record_user_name,
                   'id': level_data.record_user_id,
                   'time': level_data.record}
     else:
@@ -49,66 +83,68 @@ def level_to_details(level_data: Level, locale: str, level_file_url: str, mobile
     if desc == '' or desc is None:
         desc = 'Sin descripción'
 
-    return LevelDetails(
-        name=name,
-        likes=level_data.likes,
-        dislikes=level_data.dislikes,
-        comments=0,
-        intentos=level_data.plays,
-        muertes=level_data.deaths,
-        victorias=level_data.clears,
-        apariencia=level_data.style,
-        entorno=level_data.environment,
-        etiquetas=f'{prettify_tag_name(level_data.tag_1, locale)},{prettify_tag_name(level_data.tag_2, locale)}',
-        featured=int(level_data.featured),
-        user_data=LevelDetailsUserData(
-            completed=clear_type,
-            liked=like_type
-        ),
-        date=level_data.date.strftime("%m/%d/%Y"),
-        author=author,
-        record=record,
-        archivo=level_file_url,
-        id=level_data.level_id,
-        descripcion=desc,
+    # same fields and order as models.LevelDetails
+    head: bytes = orjson.dumps({
+        'name': name,
+        'likes': level_data.likes,
+        'dislikes': level_data.dislikes,
+        'comments': 0,
+        'intentos': level_data.plays,
+        'muertes': level_data.deaths,
+        'victorias': level_data.clears,
+        'apariencia': level_data.style,
+        'entorno': level_data.environment,
+        'etiquetas': f'{prettify_tag_name(level_data.tag_1, locale)},{prettify_tag_name(level_data.tag_2, locale)}',
+        'featured': int(level_data.featured),
+    })
+    tail: bytes = orjson.dumps({
+        'record': record,
+        'date': level_data.date.strftime("%m/%d/%Y"),
+        'author': author_name,
+        'descripcion': desc,
+        'archivo': level_file_url,
+        'id': level_data.level_id,
+    })
+    fragment = LevelFragment(head=head[:-1], tail=tail[1:])
+    _level_fragments[fragment_key] = fragment
+    while len(_level_fragments) > SEARCH_FRAGMENT_CACHE_SIZE:
+        _level_fragments.popitem(last=False)
+    return fragment
+
+
+def detailed_search_response(num_rows: int, rows_perpage: int, pages: int, rows: list[bytes],
+                             next_cursor: str | None) -> Response:
+    # same wire format as models.DetailedSearchResults, without validating every row
+    head: bytes = orjson.dumps({
+        'type': 'detailed_search',
+        'num_rows': num_rows,
+        'rows_perpage': rows_perpage,
+        'pages': pages,
+    })
+    return Response(
+        content=head[:-1] + b',"result":[' + b','.join(rows) + b'],"next_cursor":' + orjson.dumps(next_cursor) + b'}',
+        media_type='application/json'
     )
 
 
-def gen_level_id_md5(stripped_swe: str) -> str:
-    return prettify_level_id(hashlib.md5(stripped_swe.encode()).hexdigest().upper()[8:24])
-
-
-def gen_level_id_sha1(stripped_swe: str) -> str:
-    return prettify_level_id(hashlib.sha1(stripped_swe.encode()).hexdigest().upper()[8:24])
-
-
-def gen_level_id_sha256(stripped_swe: str) -> str:
-    return prettify_level_id(hashlib.sha256(stripped_swe.encode()).hexdigest().upper()[8:24])
-
-
-def strip_level(data_swe: str) -> str:
-    result = base64.b64decode(data_swe)[:-30].decode("UTF-8")
-    regex_time = re.compile('"time": ".*?"')
-    regex_date = re.compile('"date": ".*?"')
-    result = regex_date.sub('"date": ""', regex_time.sub('"time": ""', result))
-    return result
-
-
-def prettify_level_id(level_id: str):
-    return level_id[0:4] + '-' + level_id[4:8] + '-' + level_id[8:12] + '-' + level_id[12:16]
+def single_level_response(search_type: str, row: bytes) -> Response:
+    # same wire format as models.SingleLevelDetails
+    return Response(
+        content=b'{"type":' + orjson.dumps(search_type) + b',"result":' + row + b'}',
+        media_type='application/json'
+    )
 
 
 def calculate_password_hash(password: str):
     return hashlib.sha256(base64.b64encode(password.encode('utf-8'))).hexdigest()
 
 
+@lru_cache(maxsize=4096)
 def string_latinify(t):
-    table = {ord(f): ord(t) for f, t in zip(u'，。！？【】（）％＃＠＆－—〔〕：；〇﹒—﹙﹚、—“”', u',.!?[]()%#@&--():;0.—(),-""')}
-
     try:
-        t2 = t.translate(table)
+        t2 = t.translate(_latinify_table)
     except:
         t2 = t
-    t2 = Pinyin().get_pinyin(t2).replace('-', ' ')
+    t2 = _pinyin.get_pinyin(t2).replace('-', ' ')
     t2 = re.sub(u'[^\x00-\x7F\x80-\xFF\u0100-\u017F\u0180-\u024F\u1E00-\u1EFF]', u'', t2)
     return t2
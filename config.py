@@ -39,16 +39,47 @@ DATABASE_PASS = _config['database']['password']
 DATABASE_NAME = _config['database']['database']
 DATABASE_SSL = _config['database']['ssl']
 DATABASE_DEBUG = _config['database']['debug']
+DATABASE_DEBUG_HEADERS = _config['database']['debug_headers']
+DATABASE_QUERY_BUDGET = _config['database']['query_budget']
+DATABASE_REPEAT_LIMIT = _config['database']['repeat_limit']
+DATABASE_STRICT_QUERY_BUDGET = _config['database']['strict_query_budget']
+
+SEARCH_PAGE_CURSOR_CACHE_SIZE = _config['search']['page_cursor_cache_size']
+SEARCH_PAGE_CURSOR_TTL = _config['search']['page_cursor_ttl']
+SEARCH_COUNT_CACHE_SIZE = _config['search']['count_cache_size']
+SEARCH_COUNT_CACHE_TTL = _config['search']['count_cache_ttl']
+SEARCH_COUNT_ESTIMATE_LIMIT = _config['search']['count_estimate_limit']
+SEARCH_RANDOM_POOL_REFRESH_INTERVAL = _config['search']['random_pool_refresh_interval']
+SEARCH_RESPONSE_CACHE_TTL = _config['search']['response_cache_ttl']
+SEARCH_FRAGMENT_CACHE_SIZE = _config['search']['fragment_cache_size']
+
+COUNTERS_FLUSH_INTERVAL = _config['counters']['flush_interval']
+STATS_RECONCILE_INTERVAL = _config['stats']['reconcile_interval']
+STATS_CACHE_TTL = _config['stats']['cache_ttl']
+INGEST_WORKERS = _config['ingest']['workers']
+INGEST_MAX_QUEUE = _config['ingest']['max_queue']
+USER_DIRECTORY_CACHE_SIZE = _config['user_directory']['cache_size']
+USER_DIRECTORY_PUBSUB = _config['user_directory']['pubsub']
 
 SESSION_REDIS_HOST = _config['redis']['host']
 SESSION_REDIS_PORT = _config['redis']['port']
 SESSION_REDIS_DB = _config['redis']['database']
 SESSION_REDIS_PASS = _config['redis']['password']
+SESSION_CACHE_SIZE = _config['redis']['session_cache_size']
+SESSION_CACHE_TTL = _config['redis']['session_cache_ttl']
 
 STORAGE_PROVIDER = _config['storage']['provider']
 STORAGE_URL = _config['storage']['url']
 STORAGE_AUTH_KEY = _config['storage']['auth_key']
 STORAGE_PROXIED = _config['storage']['proxied']
+STORAGE_DOWNLOAD_CACHE_SIZE = _config['storage']['download_cache_size']
+STORAGE_PATH = _config['storage']['path']
+STORAGE_LEVEL_NAME_CACHE_SIZE = _config['storage']['level_name_cache_size']
+
+PUSH_TIMEOUT = _config['push']['timeout']
+PUSH_RETRIES = _config['push']['retries']
+PUSH_CONCURRENCY = _config['push']['concurrency']
+PUSH_OUTBOX_LIMIT = _config['push']['outbox_limit']
 
 ENABLE_ENGINE_BOT_WEBHOOK = _config['push']['engine_bot']['enabled']
 ENABLE_ENGINE_BOT_COUNTER_WEBHOOK = _config['push']['engine_bot']['enable_counter']
@@ -61,3 +92,4 @@ DISCORD_WEBHOOK_URLS = _config['push']['discord']['urls']
 DISCORD_AVATAR_URL = _config['push']['discord']['avatar']
 DISCORD_NICKNAME = _config['push']['discord']['nickname']
 DISCORD_SERVER_NAME = _config['push']['discord']['server_name']
+DISCORD_COALESCE_DELAY = _config['push']['discord']['coalesce_delay']
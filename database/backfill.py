@@ -0,0 +1,117 @@
+import argparse
+import asyncio
+from hashlib import sha256
+import zlib
+
+from sqlalchemy import select, func, update, delete, bindparam, and_
+from loguru import logger
+
+from database.db import Database
+from database.db_access import DBAccessLayer
+from database.models import Level, LevelData, LevelTrigram
+from database.difficulty import difficulty_bucket_expression
+from database.search import level_search
+from common import string_latinify
+
+'''
+Fills derived columns of existing rows.
+Usage: python -m database.backfill difficulty search names blobs
+'''
+
+BATCH_SIZE: int = 5000
+BLOB_BATCH_SIZE: int = 100  # level data rows are up to a few MB each
+
+
+async def backfill_difficulty(db: Database):
+    async with db.engine.begin() as conn:
+        max_id: int = (await conn.execute(select(func.max(Level.id)))).scalar() or 0
+    for start in range(0, max_id + 1, BATCH_SIZE):
+        # one short transaction per batch to keep row locks brief
+        async with db.engine.begin() as conn:
+            await conn.execute(
+                update(Level).where(Level.id.between(start, start + BATCH_SIZE - 1)).values(
+                    difficulty=difficulty_bucket_expression(Level.plays, Level.clears)
+                )
+            )
+        logger.info(f'Backfilled difficulty of levels up to {min(start + BATCH_SIZE - 1, max_id)} / {max_id}')
+
+
+async def backfill_search(db: Database):
+    # only SQLite keeps its own title search index
+    if level_search.adapter != 'sqlite':
+        return
+    async with db.async_session() as session:
+        async with session.begin():
+            await session.execute(delete(LevelTrigram))
+            levels = (await session.execute(select(Level))).scalars().all()
+            for level in levels:
+                await level_search.index_level(session, level)
+    logger.info(f'Indexed titles of {len(levels)} levels')
+
+
+async def backfill_names(db: Database):
+    async with db.engine.begin() as conn:
+        max_id: int = (await conn.execute(select(func.max(Level.id)))).scalar() or 0
+    statement = update(Level.__table__).where(Level.__table__.c.id == bindparam('pk')).values(
+        name_latin=bindparam('latin')
+    )
+    for start in range(0, max_id + 1, BATCH_SIZE):
+        async with db.engine.begin() as conn:
+            levels = (await conn.execute(
+                select(Level.id, Level.name).where(and_(
+                    Level.id.between(start, start + BATCH_SIZE - 1),
+                    Level.non_latin == True,
+                    Level.name_latin.is_(None)
+                ))
+            )).all()
+            if levels:
+                await conn.execute(statement, [
+                    {'pk': level.id, 'latin': string_latinify(level.name)} for level in levels
+                ])
+        logger.info(f'Backfilled latinified names of levels up to {min(start + BATCH_SIZE - 1, max_id)} / {max_id}')
+
+
+async def backfill_blobs(db: Database):
+    # move level data stored inline into the deduplicated blob store
+    async with db.engine.begin() as conn:
+        max_id: int = (await conn.execute(select(func.max(LevelData.id)))).scalar() or 0
+    for start in range(0, max_id + 1, BLOB_BATCH_SIZE):
+        async with db.async_session() as session:
+            async with session.begin():
+                dal = DBAccessLayer(session)
+                level_datas = (await session.execute(
+                    select(LevelData).where(and_(
+                        LevelData.id.between(start, start + BLOB_BATCH_SIZE - 1),
+                        LevelData.blob_hash.is_(None)
+                    ))
+                )).scalars().all()
+                for level_data in level_datas:
+                    raw_data: bytes = level_data.level_data.encode() if isinstance(level_data.level_data, str) \
+                        else level_data.level_data
+                    level_data.blob_hash = sha256(raw_data).hexdigest()
+                    await dal.add_level_blob(blob_hash=level_data.blob_hash, blob_data=zlib.compress(raw_data))
+                    level_data.level_data = None
+        logger.info(f'Moved level data up to {min(start + BLOB_BATCH_SIZE - 1, max_id)} / {max_id} to blobs')
+
+
+BACKFILLS = {
+    'difficulty': backfill_difficulty,
+    'search': backfill_search,
+    'names': backfill_names,
+    'blobs': backfill_blobs,
+}
+
+
+async def main(names: list[str]):
+    db = Database()
+    await db.create_columns()
+    await level_search.setup(db)
+    for name in names:
+        await BACKFILLS[name](db)
+    await db.engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fill derived columns of existing rows.')
+    parser.add_argument('columns', nargs='+', choices=list(BACKFILLS))
+    asyncio.run(main(parser.parse_args().columns))
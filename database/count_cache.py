@@ -0,0 +1,37 @@
+from collections import OrderedDict
+from time import monotonic
+
+from config import SEARCH_COUNT_CACHE_SIZE, SEARCH_COUNT_CACHE_TTL
+
+
+class LevelCountCache:
+    # Row counts of level searches keyed by their normalized filters.
+    # Cleared whenever the set of levels or their featured flag changes,
+    # the TTL bounds how stale other workers' entries can get
+    def __init__(self, max_size: int, ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._counts: OrderedDict[tuple, tuple[float, int]] = OrderedDict()
+
+    def get(self, count_key: tuple) -> int | None:
+        item = self._counts.get(count_key)
+        if item is None:
+            return None
+        expires, count = item
+        if expires < monotonic():
+            del self._counts[count_key]
+            return None
+        self._counts.move_to_end(count_key)
+        return count
+
+    def set(self, count_key: tuple, count: int):
+        self._counts[count_key] = (monotonic() + self.ttl, count)
+        self._counts.move_to_end(count_key)
+        while len(self._counts) > self.max_size:
+            self._counts.popitem(last=False)
+
+    def invalidate(self):
+        self._counts.clear()
+
+
+level_count_cache = LevelCountCache(max_size=SEARCH_COUNT_CACHE_SIZE, ttl=SEARCH_COUNT_CACHE_TTL)
@@ -0,0 +1,109 @@
+from dataclasses import dataclass
+
+from sqlalchemy import update, select, bindparam
+from sqlalchemy.exc import SQLAlchemyError
+
+from database.db import Database
+from database.models import Level, User
+from database.difficulty import difficulty_bucket_expression
+from database.random_pool import random_level_pool
+
+'''
+Write-behind level counters.
+Stats endpoints only add to in-process deltas, which are flushed periodically as
+UPDATE level_table SET plays = plays + :n ... batches, so increments never race.
+The difficulty bucket is recomputed by the same statement.
+'''
+
+COUNTERS: tuple[str, ...] = ("plays", "deaths", "clears", "likes", "dislikes")
+MILESTONES: tuple[int, ...] = (100, 1000)
+
+
+@dataclass
+class CounterMilestone:
+    counter: str  # plays, deaths, clears or likes
+    value: int  # 100 or 1000
+    level_id: str
+    level_name: str
+    author_name: str
+
+
+def counter_update_statement():
+    # adds the delta_* parameters to the counters of level pk and recomputes its difficulty;
+    # difficulty is assigned first as MySQL evaluates SET left to right, later assignments see updated columns
+    table = Level.__table__
+    return update(table).where(table.c.id == bindparam('pk')).ordered_values(
+        ('difficulty', difficulty_bucket_expression(
+            table.c.plays + bindparam('delta_plays'),
+            table.c.clears + bindparam('delta_clears')
+        )),
+        *[(counter, table.c[counter] + bindparam(f'delta_{counter}')) for counter in COUNTERS]
+    )
+
+
+class LevelCounterBuffer:
+    def __init__(self):
+        self._deltas: dict[int, dict[str, int]] = {}  # level_table.id -> counter -> delta
+
+    def add(self, level_pk: int, counter: str, amount: int = 1):
+        deltas = self._deltas.setdefault(level_pk, dict.fromkeys(COUNTERS, 0))
+        deltas[counter] += amount
+
+    def __len__(self) -> int:
+        return len(self._deltas)
+
+    async def flush(self, db: Database) -> list[CounterMilestone]:
+        # apply pending deltas and return the 100 / 1000 milestones they crossed
+        if not self._deltas:
+            return []
+        deltas, self._deltas = self._deltas, {}
+        level_pks: list[int] = sorted(deltas)  # fixed lock order between workers
+        table = Level.__table__
+        statement = counter_update_statement()
+        try:
+            async with db.async_session() as session:
+                async with session.begin():
+                    await session.execute(statement, [
+                        {'pk': level_pk, **{f'delta_{counter}': deltas[level_pk][counter] for counter in COUNTERS}}
+                        for level_pk in level_pks
+                    ])
+                    # rows stay locked by the UPDATE, so these are exactly the totals we produced
+                    levels = (await session.execute(
+                        select(Level.id, Level.level_id, Level.name, Level.author_id, Level.difficulty,
+                               *[table.c[counter] for counter in COUNTERS]).where(Level.id.in_(level_pks))
+                    )).all()
+                    crossed: list[tuple] = []
+                    for level in levels:
+                        random_level_pool.add(level.id, level.difficulty)
+                        for counter in COUNTERS:
+                            new_value: int = getattr(level, counter)
+                            old_value: int = new_value - deltas[level.id][counter]
+                            for milestone in MILESTONES:
+                                if counter != "dislikes" and old_value < milestone <= new_value:
+                                    crossed.append((level, counter, milestone))
+                    if not crossed:
+                        return []
+                    authors: dict[int, str] = {
+                        user_id: username for user_id, username in (await session.execute(
+                            select(User.id, User.username).where(User.id.in_({level.author_id for level, _, _ in crossed}))
+                        )).all()
+                    }
+        except SQLAlchemyError:
+            # keep the deltas for the next flush
+            for level_pk, level_deltas in deltas.items():
+                for counter, amount in level_deltas.items():
+                    if amount:
+                        self.add(level_pk, counter, amount)
+            raise
+        return [
+            CounterMilestone(
+                counter=counter,
+                value=milestone,
+                level_id=level.level_id,
+                level_name=level.name,
+                author_name=authors.get(level.author_id, "Unknown")
+            ) for level, counter, milestone in crossed
+        ]
+
+
+level_counters = LevelCounterBuffer()
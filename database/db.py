@@ -6,7 +6,11 @@ from sqlalchemy.ext.asyncio import (
     create_async_engine,
     async_sessionmaker
 )
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import DeclarativeBase
+from loguru import logger
 import ssl
 
 
@@ -50,3 +54,59 @@ class Database:
     async def create_columns(self):
         async with self.engine.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)
+            await conn.run_sync(upgrade_schema)
+        # index DDL commits implicitly on MySQL, so every index gets its own transaction
+        async with self.engine.connect() as conn:
+            await conn.run_sync(create_missing_indexes)
+
+
+# columns derived from other data, which need a backfill after being added -> backfill command
+BACKFILLED_COLUMNS: dict[str, str] = {
+    'difficulty': 'difficulty',
+    'name_latin': 'names',
+    'blob_hash': 'blobs',
+}
+
+
+def upgrade_schema(conn):
+    # create_all() skips tables that already exist, so bring older databases up to date here
+    inspector = inspect(conn)
+    preparer = conn.dialect.identifier_preparer
+    for table in Base.metadata.sorted_tables:
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            logger.info(f'Adding column {column.name} to {table.name}')
+            conn.execute(text(
+                f'ALTER TABLE {preparer.format_table(table)} '
+                f'ADD COLUMN {CreateColumn(column).compile(dialect=conn.dialect)}'
+            ))
+            if column.name in BACKFILLED_COLUMNS:
+                logger.warning(f'Column {column.name} of {table.name} is empty, '
+                               f'run `python -m database.backfill {BACKFILLED_COLUMNS[column.name]}` to fill it')
+
+
+def create_missing_indexes(conn):
+    # create_all() skips indexes of tables that already exist
+    for table in Base.metadata.sorted_tables:
+        existing_indexes = {index['name'] for index in inspect(conn).get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+            logger.info(f'Creating index {index.name} on {table.name}')
+            try:
+                index.create(conn)
+                conn.commit()
+            except SQLAlchemyError as e:
+                # e.g. duplicated level IDs prevent the unique level_id index
+                conn.rollback()
+                if index.name not in {existing['name'] for existing in inspect(conn).get_indexes(table.name)}:
+                    logger.error(f'Failed to create index {index.name} on {table.name}: {e}')
+
+    # verify
+    for table in Base.metadata.sorted_tables:
+        existing_indexes = {index['name'] for index in inspect(conn).get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                logger.warning(f'Index {index.name} is missing on {table.name}, queries on it will scan the table')
@@ -1,9 +1,43 @@
+from dataclasses import dataclass
 from sqlalchemy.ext.asyncio import AsyncSession
-from database.models import Level, LevelData, User, ClearedUsers, LikeUsers, DislikeUsers, Client
+from database.models import Level, LevelData, LevelBlob, User, ClearedUsers, LikeUsers, DislikeUsers, Client
 import datetime
 from sqlalchemy import func, select, delete
 from sqlalchemy import or_, and_
-from config import RECORD_CLEAR_USERS
+from sqlalchemy.exc import IntegrityError
+from config import RECORD_CLEAR_USERS, SEARCH_COUNT_ESTIMATE_LIMIT
+from database.count_cache import level_count_cache
+from database.level_names import level_names
+from database.counters import level_counters
+from database.random_pool import random_level_pool
+from database.search import level_search
+from database.totals import site_totals
+from database.user_directory import user_directory
+
+RANDOM_LEVEL_ATTEMPTS: int = 5  # retries when the pool holds levels changed by other workers
+
+
+@dataclass
+class LevelHydration:
+    # Authors, record holders and the user's likes / clears of a page of levels,
+    # resolved together by DBAccessLayer.hydrate_levels
+    usernames: dict[int, str]
+    like_types: dict[int, str]
+    clear_types: dict[int, str]
+
+    def author_name(self, author_id: int) -> str:
+        return self.usernames.get(author_id, "Unknown")
+
+    def record_user_name(self, record_user_id: int) -> str:
+        if record_user_id == 0:
+            return "None"
+        return self.usernames.get(record_user_id, "Unknown")
+
+    def like_type(self, level_pk: int) -> str:
+        return self.like_types.get(level_pk, '3')  # none
+
+    def clear_type(self, level_pk: int) -> str:
+        return self.clear_types.get(level_pk, 'no')
 
 
 class DBAccessLayer:
@@ -11,20 +45,26 @@ class DBAccessLayer:
         self.session = session
 
     async def add_level(self, name: str, style: int, environment: int, tag_1: int, tag_2: int, author_id: int,
-                        level_id: str, non_latin: bool, testing_client: bool, description: str):
+                        level_id: str, non_latin: bool, testing_client: bool, description: str,
+                        name_latin: str | None = None):
         # add level metadata into database
         level = Level(name=name, likes=0, dislikes=0, plays=0, deaths=0, clears=0,
                       style=style, environment=environment, tag_1=tag_1, tag_2=tag_2,
                       date=datetime.date.today(), author_id=author_id,
-                      level_id=level_id, non_latin=non_latin, record_user_id=0, record=0,
+                      level_id=level_id, non_latin=non_latin, name_latin=name_latin, record_user_id=0, record=0,
                       testing_client=testing_client, featured=False, description=description)
         self.session.add(level)
         await self.session.flush()
+        await level_search.index_level(self.session, level)
+        level_count_cache.invalidate()
+        random_level_pool.add(level.id, level.difficulty)
+        site_totals.add_level(self.session)
         return level
 
     async def update_user(self, user: User):
         self.session.add(user)
         await self.session.flush()
+        user_directory.invalidate(user.id)
 
     async def add_user(self, username: str, password_hash: str, im_id: int):
         # register user
@@ -33,54 +73,84 @@ class DBAccessLayer:
 
         self.session.add(user)
         await self.session.flush()
+        user_directory.add(user.id, user.username, user.im_id)
+        site_totals.add_player(self.session)
 
     async def execute_selection(self, selection) -> list:
         return (await self.session.execute(
             selection
         )).scalars().all()
 
-    async def get_like_type(self, level: Level, user_id: int) -> str:
-        # get user's like type (like or dislike or none) of a level
-        like = (await self.session.execute(
-            select(LikeUsers).where(and_(LikeUsers.parent_id == level.id,
-                                    LikeUsers.user_id == user_id))
-        )).scalars().first()
-        dislike = (await self.session.execute(
-            select(DislikeUsers).where(and_(DislikeUsers.parent_id == level.id,
-                                       DislikeUsers.user_id == user_id))
-        )).scalars().first()
-        if like is not None:
-            return '0'  # like
-        elif dislike is not None:
-            return '1'  # dislike
-        else:
-            return '3'  # none
+    async def get_usernames_by_ids(self, user_ids: set[int]) -> dict[int, str]:
+        # get usernames of many users at once, only users missing from the directory are queried
+        usernames: dict[int, str] = {}
+        missing_ids: set[int] = set()
+        for user_id in user_ids:
+            if (username := user_directory.get_username(user_id)) is not None:
+                usernames[user_id] = username
+            else:
+                missing_ids.add(user_id)
+        if missing_ids:
+            for user_id, username, im_id in (await self.session.execute(
+                    select(User.id, User.username, User.im_id).where(User.id.in_(missing_ids))
+            )).all():
+                user_directory.add(user_id, username, im_id)
+                usernames[user_id] = username
+        return usernames
+
+    async def hydrate_levels(self, levels: list[Level], user_id: int) -> LevelHydration:
+        # resolve users, likes, dislikes and clears of a page of levels with a constant number of queries
+        user_ids: set[int] = {level.author_id for level in levels} | {
+            level.record_user_id for level in levels if level.record_user_id != 0
+        }
+        hydration = await self.get_level_marks({level.id for level in levels}, user_id)
+        hydration.usernames = await self.get_usernames_by_ids(user_ids)
+        return hydration
+
+    async def get_level_marks(self, level_pks: set[int], user_id: int) -> LevelHydration:
+        # resolve only the user's likes, dislikes and clears of a page of levels
+        hydration = LevelHydration(usernames={}, like_types={}, clear_types={})
+        if not level_pks:
+            return hydration
+        for parent_id in (await self.session.execute(
+                select(DislikeUsers.parent_id).where(and_(DislikeUsers.parent_id.in_(level_pks),
+                                                          DislikeUsers.user_id == user_id))
+        )).scalars().all():
+            hydration.like_types[parent_id] = '1'  # dislike
+        for parent_id in (await self.session.execute(
+                select(LikeUsers.parent_id).where(and_(LikeUsers.parent_id.in_(level_pks),
+                                                       LikeUsers.user_id == user_id))
+        )).scalars().all():
+            hydration.like_types[parent_id] = '0'  # like, takes precedence over dislike
+        if RECORD_CLEAR_USERS:
+            for parent_id in (await self.session.execute(
+                    select(ClearedUsers.parent_id).where(and_(ClearedUsers.parent_id.in_(level_pks),
+                                                              ClearedUsers.user_id == user_id))
+            )).scalars().all():
+                hydration.clear_types[parent_id] = 'yes'
+        return hydration
 
     async def add_like_to_level(self, user_id: int, level: Level):
-        # add like to level
+        # add like to level, the counter itself is written behind
         like = LikeUsers(parent_id=level.id, user_id=user_id)
-        level.likes += 1
-        self.session.add_all([like, level])
+        self.session.add(like)
         await self.session.flush()
+        level_counters.add(level.id, "likes")
 
     async def add_dislike_to_level(self, user_id: int, level: Level):
-        # add dislike to level
+        # add dislike to level, the counter itself is written behind
         dislike = DislikeUsers(parent_id=level.id, user_id=user_id)
-        level.dislikes += 1
-        self.session.add_all([dislike, level])
+        self.session.add(dislike)
         await self.session.flush()
+        level_counters.add(level.id, "dislikes")
 
     async def add_play_to_level(self, level: Level):
         # add play to level
-        level.plays += 1
-        self.session.add(level)
-        await self.session.flush()
+        level_counters.add(level.id, "plays")
 
     async def add_death_to_level(self, level: Level):
         # add death to level
-        level.deaths += 1
-        self.session.add(level)
-        await self.session.flush()
+        level_counters.add(level.id, "deaths")
 
     async def add_clear_to_level(self, user_id: int, level: Level):
         # add clear to level
@@ -91,9 +161,8 @@ class DBAccessLayer:
             )).scalars().first() is None:
                 clear = ClearedUsers(parent_id=level.id, user_id=user_id)
                 self.session.add(clear)
-        level.clears += 1
-        self.session.add(level)
-        await self.session.flush()
+                await self.session.flush()
+        level_counters.add(level.id, "clears")
 
     async def update_record_to_level(self, user_id: int, level: Level, record: int):
         # update record to level
@@ -103,25 +172,48 @@ class DBAccessLayer:
         await self.session.flush()
 
     async def get_user_by_username(self, username: str) -> User | None:
-        # get user from username
+        # get user from username, by primary key if the directory knows it
+        if (user_id := user_directory.get_id_by_username(username)) is not None:
+            user = await self.get_user_by_id(user_id)
+            if user is not None and user.username == username:
+                return user
+            user_directory.invalidate(user_id)
         user = (await self.session.execute(
             select(User).where(User.username == username)
         )).scalars().first()
-        return user if (user is not None) else None
+        if user is not None:
+            user_directory.add(user.id, user.username, user.im_id)
+        return user
+
+    async def get_user_id_by_username(self, username: str) -> int | None:
+        # get only the id of a user, without a query if the directory knows it
+        if (user_id := user_directory.get_id_by_username(username)) is not None:
+            return user_id
+        user = await self.get_user_by_username(username)
+        return user.id if (user is not None) else None
 
     async def get_user_by_id(self, user_id: int) -> User | None:
         # get user from id
         user = (await self.session.execute(
             select(User).where(User.id == user_id)
         )).scalars().first()
-        return user if (user is not None) else None
+        if user is not None:
+            user_directory.add(user.id, user.username, user.im_id)
+        return user
 
     async def get_user_by_im_id(self, im_id: int) -> User | None:
-        # get user from IM user id
+        # get user from IM user id, by primary key if the directory knows it
+        if (user_id := user_directory.get_id_by_im_id(im_id)) is not None:
+            user = await self.get_user_by_id(user_id)
+            if user is not None and user.im_id == im_id:
+                return user
+            user_directory.invalidate(user_id)
         user = (await self.session.execute(
             select(User).where(User.im_id == im_id)
         )).scalars().first()
-        return user if (user is not None) else None
+        if user is not None:
+            user_directory.add(user.id, user.username, user.im_id)
+        return user
 
     async def get_level_by_level_id(self, level_id: str) -> Level | None:
         # get level from level id
@@ -130,19 +222,44 @@ class DBAccessLayer:
         )).scalars().first()
         return level if (level is not None) else None
 
-    async def get_clear_type(self, level: Level, user_id: int) -> str:
-        # get user's clear type (yes or no) of a level
-        if RECORD_CLEAR_USERS:
-            clear = (await self.session.execute(
-                select(ClearedUsers).where(and_(ClearedUsers.parent_id == level.id,
-                                           ClearedUsers.user_id == user_id))
-            )).scalars().first()
-            if clear is not None:
-                return 'yes'
+    async def get_level_name(self, level_id: str) -> str | None:
+        # None if the level does not exist, cached as level file downloads only need the name
+        name: str | None = level_names.get(level_id)
+        if name is None:
+            name = (await self.session.execute(
+                select(Level.name).where(Level.level_id == level_id)
+            )).scalar()
+            if name is not None:
+                level_names.set(level_id, name)
+        return name
+
+    async def get_levels_by_ids(self, level_pks: list[int]) -> list[Level]:
+        # get levels by level_table.id, in the given order
+        if not level_pks:
+            return []
+        levels: dict[int, Level] = {
+            level.id: level for level in (await self.session.execute(
+                select(Level).where(Level.id.in_(level_pks))
+            )).scalars().all()
+        }
+        return [levels[level_pk] for level_pk in level_pks if level_pk in levels]
+
+    async def get_random_level(self, difficulty: int | None = None) -> Level | None:
+        # pick a random level from the in-process pool, None if there is no level of that difficulty
+        for _ in range(RANDOM_LEVEL_ATTEMPTS):
+            level_pk = random_level_pool.choice(difficulty)
+            if level_pk is None:
+                return None
+            level = await self.session.get(Level, level_pk)
+            if level is None:
+                # deleted by another worker
+                random_level_pool.remove(level_pk)
+            elif difficulty is not None and level.difficulty != difficulty:
+                # difficulty changed on another worker
+                random_level_pool.add(level_pk, level.difficulty)
             else:
-                return 'no'
-        else:
-            return 'no'
+                return level
+        return None
 
     async def get_liked_levels_by_user(self, user_id: int) -> list[LikeUsers]:
         # get user's liked levels
@@ -168,18 +285,40 @@ class DBAccessLayer:
             )
         ).scalars().all()
 
-    async def add_level_data(self, level_id: str, level_data, level_checksum: str):
-        # add level data into database as bytes
-        if isinstance(level_data, str):
-            level_data = level_data.encode()
+    async def add_level_data(self, level_id: str, blob_hash: str, level_checksum: str):
+        # add level data into database, the data itself is in the blob store
         level_data_item = LevelData(
             level_id=level_id,
-            level_data=level_data,
-            level_checksum=level_checksum
+            level_checksum=level_checksum,
+            blob_hash=blob_hash
         )
         self.session.add(level_data_item)
         await self.session.flush()
 
+    async def add_level_blob(self, blob_hash: str, blob_data: bytes):
+        # store a compressed level blob unless identical data is already stored;
+        # inserting first only locks the new row, a locking read of a missing hash would take a gap lock
+        # that deadlocks concurrent uploads of other levels on InnoDB
+        while True:
+            try:
+                async with self.session.begin_nested():
+                    self.session.add(LevelBlob(blob_hash=blob_hash, blob_data=blob_data))
+                return
+            except IntegrityError:
+                pass  # already stored
+            # keep the stored blob locked until the referencing LevelData is committed,
+            # so a concurrent delete_level_data cannot drop it in between
+            if (await self.session.execute(
+                    select(LevelBlob.id).where(LevelBlob.blob_hash == blob_hash).with_for_update()
+            )).first() is not None:
+                return
+            # dropped by a concurrent delete_level_data meanwhile, store it again
+
+    async def get_level_blob(self, blob_hash: str) -> LevelBlob | None:
+        return (await self.session.execute(
+            select(LevelBlob).where(LevelBlob.blob_hash == blob_hash)
+        )).scalars().first()
+
     async def dump_level_data(self, level_id: str) -> LevelData | None:
         level_data_item = (await self.session.execute(
             select(LevelData).where(LevelData.level_id == level_id)
@@ -197,34 +336,62 @@ class DBAccessLayer:
         await self.session.execute(
             delete(DislikeUsers).where(DislikeUsers.parent_id == level.id)
         )
+        await level_search.unindex_level(self.session, level)
         await self.session.flush()
+        level_count_cache.invalidate()
+        random_level_pool.remove(level.id)
+        level_names.invalidate(level.level_id)
+        site_totals.remove_level(self.session)
 
     async def delete_level_data(self, level_id: str):
+        blob_hashes: set[str] = set((await self.session.execute(
+            select(LevelData.blob_hash).where(and_(LevelData.level_id == level_id, LevelData.blob_hash != None))
+        )).scalars().all())
         await self.session.execute(
             delete(LevelData).where(LevelData.level_id == level_id)
         )
+        # drop blobs no other level shares, references are re-checked with the blob row locked
+        # so an identical upload either finished before or stores the blob again afterwards
+        for blob_hash in blob_hashes:
+            if (await self.session.execute(
+                    select(LevelBlob.id).where(LevelBlob.blob_hash == blob_hash).with_for_update()
+            )).first() is None:
+                continue
+            if (await self.session.execute(
+                    select(LevelData.id).where(LevelData.blob_hash == blob_hash).limit(1).with_for_update()
+            )).first() is None:
+                await self.session.execute(
+                    delete(LevelBlob).where(LevelBlob.blob_hash == blob_hash)
+                )
         await self.session.flush()
 
     async def set_featured(self, level: Level, is_featured: bool):
         level.featured = is_featured
         self.session.add(level)
         await self.session.flush()
+        level_count_cache.invalidate()
 
     async def get_level_count(self, selection=None) -> int:
         if selection is None:
             selection = select(Level)
         return (
             await self.session.execute(
-                select(func.count()).select_from(selection)
+                select(func.count()).select_from(selection.subquery())
             )
         ).scalars().first()
 
-    async def get_player_count(self) -> int:
-        return (
-            await self.session.execute(
-                select(func.count()).select_from(User)
-            )
-        ).scalars().first()
+    async def count_levels(self, selection, count_key: tuple | None = None, estimate: bool = False) -> int:
+        # count the rows of a level search, cached by its normalized filters
+        # estimated counts stop counting at SEARCH_COUNT_ESTIMATE_LIMIT rows
+        if count_key is not None and (count := level_count_cache.get(count_key)) is not None:
+            return count
+        if estimate:
+            count = await self.get_level_count(selection.limit(SEARCH_COUNT_ESTIMATE_LIMIT))
+        else:
+            count = await self.get_level_count(selection)
+        if count_key is not None:
+            level_count_cache.set(count_key, count)
+        return count
 
     async def get_client_by_token(self, token: str) -> Client | None:
         return (await self.session.execute(
@@ -0,0 +1,33 @@
+from sqlalchemy import case
+
+'''
+Difficulty buckets of levels by clear rate (clears / plays):
+0 easy >= 20%, 1 normal >= 8%, 2 hard >= 1%, 3 expert < 1%, None if never played.
+Compared with multiplications so integer division never kicks in.
+'''
+
+DIFFICULTIES: tuple[int, ...] = (0, 1, 2, 3)
+
+
+def difficulty_bucket(plays: int, clears: int) -> int | None:
+    if plays == 0:
+        return None
+    elif clears * 5 >= plays:
+        return 0  # Easy
+    elif clears * 25 >= plays * 2:
+        return 1  # Normal
+    elif clears * 100 >= plays:
+        return 2  # Hard
+    else:
+        return 3  # Expert
+
+
+def difficulty_bucket_expression(plays, clears):
+    # SQL version of difficulty_bucket over column expressions
+    return case(
+        (plays == 0, None),
+        (clears * 5 >= plays, 0),
+        (clears * 25 >= plays * 2, 1),
+        (clears * 100 >= plays, 2),
+        else_=3
+    )
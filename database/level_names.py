@@ -0,0 +1,30 @@
+from collections import OrderedDict
+
+from config import STORAGE_LEVEL_NAME_CACHE_SIZE
+
+
+class LevelNameCache:
+    # Names of levels by level id, so level file downloads need no database query.
+    # Names never change after upload; deleted levels are dropped here, other workers' stale
+    # entries are harmless as the level file is gone as well
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._names: OrderedDict[str, str] = OrderedDict()
+
+    def get(self, level_id: str) -> str | None:
+        name = self._names.get(level_id)
+        if name is not None:
+            self._names.move_to_end(level_id)
+        return name
+
+    def set(self, level_id: str, name: str):
+        self._names[level_id] = name
+        self._names.move_to_end(level_id)
+        while len(self._names) > self.max_size:
+            self._names.popitem(last=False)
+
+    def invalidate(self, level_id: str):
+        self._names.pop(level_id, None)
+
+
+level_names = LevelNameCache(max_size=STORAGE_LEVEL_NAME_CACHE_SIZE)
@@ -1,9 +1,16 @@
 from database.db import Base
-from sqlalchemy import Column, Integer, UnicodeText, Text, Date, Boolean, LargeBinary, String, BigInteger, SmallInteger
+from sqlalchemy import Column, Index, Integer, Unicode, UnicodeText, Text, Date, Boolean, LargeBinary, String, BigInteger, SmallInteger
 
 
 class Level(Base):
-    __table_args = {'mysql_charset': 'utf8mb4'}
+    __table_args__ = (
+        Index('ix_level_table_level_id', 'level_id', unique=True),
+        Index('ix_level_table_author_id', 'author_id'),
+        Index('ix_level_table_featured_id', 'featured', 'id'),
+        Index('ix_level_table_testing_client_id', 'testing_client', 'id'),
+        Index('ix_level_table_difficulty_id', 'difficulty', 'id'),
+        {'mysql_charset': 'utf8mb4'}
+    )
     __mapper_args__ = {"eager_defaults": True}
     __tablename__ = "level_table"
 
@@ -24,14 +31,19 @@ class Level(Base):
     author_id = Column(Integer)  # Level maker's ID
     level_id = Column(String(19))  # Level ID
     non_latin = Column(Boolean)  # Whether the level name contains non-Latin characters
+    name_latin = Column(UnicodeText)  # Latinified level name for mobile clients, None if the name is Latin
     featured = Column(Boolean)  # Whether the level is in promising levels
     record_user_id = Column(Integer)  # Record user's ID
     record = Column(BigInteger)  # Record (ticks)
     testing_client = Column(Boolean)  # For 3.3.0+ testing client
+    difficulty = Column(SmallInteger)  # Difficulty bucket by clear rate (0 - 3), None if never played
 
 
 class LikeUsers(Base):
     __tablename__ = "likes_table"
+    __table_args__ = (
+        Index('ix_likes_table_parent_id_user_id', 'parent_id', 'user_id'),
+    )
 
     id = Column(Integer, primary_key=True)
     parent_id = Column(Integer)
@@ -41,6 +53,9 @@ class LikeUsers(Base):
 
 class DislikeUsers(Base):
     __tablename__ = "dislikes_table"
+    __table_args__ = (
+        Index('ix_dislikes_table_parent_id_user_id', 'parent_id', 'user_id'),
+    )
 
     id = Column(Integer, primary_key=True)
     parent_id = Column(Integer)
@@ -50,6 +65,9 @@ class DislikeUsers(Base):
 
 class ClearedUsers(Base):
     __tablename__ = "clears_table"
+    __table_args__ = (
+        Index('ix_clears_table_parent_id_user_id', 'parent_id', 'user_id'),
+    )
 
     id = Column(Integer, primary_key=True)
     parent_id = Column(Integer)
@@ -57,6 +75,19 @@ class ClearedUsers(Base):
     user_id = Column(Integer)
 
 
+class LevelTrigram(Base):  # used in title search on SQLite
+    __tablename__ = "level_trigram_table"
+    __table_args__ = (
+        Index('ix_level_trigram_table_trigram_parent_id', 'trigram', 'parent_id'),
+        Index('ix_level_trigram_table_parent_id', 'parent_id'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    parent_id = Column(Integer)
+
+    trigram = Column(Unicode(3))  # Lowercase trigram of level name or description
+
+
 class User(Base):
     __tablename__ = "user_table"
 
@@ -75,12 +106,54 @@ class User(Base):
 
 class LevelData(Base):  # used in StorageProviderDatabase
     __tablename__ = "level_data_table"
+    __table_args__ = (
+        Index('ix_level_data_table_level_id', 'level_id'),
+        Index('ix_level_data_table_blob_hash', 'blob_hash'),
+    )
 
     id = Column(Integer, primary_key=True)
 
     level_id = Column(String(19))  # Level id
-    level_data = Column(LargeBinary)  # Leve data without checksum
+    level_data = Column(LargeBinary)  # Leve data without checksum, None if stored in a blob
     level_checksum = Column(String(40))  # SHA-1 HMAC checksum
+    blob_hash = Column(String(64))  # SHA-256 of the level data, key of its LevelBlob
+
+
+class LevelBlob(Base):  # Deduplicated, compressed level data
+    __tablename__ = "level_blob_table"
+    __table_args__ = (
+        Index('ix_level_blob_table_blob_hash', 'blob_hash', unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+
+    blob_hash = Column(String(64))  # SHA-256 of the uncompressed level data
+    blob_data = Column(LargeBinary(16 * 1024 * 1024))  # zlib compressed level data
+
+
+class PushEvent(Base):  # Webhook pushes not delivered yet
+    __tablename__ = "push_outbox_table"
+    __table_args__ = (
+        Index('ix_push_outbox_table_target_id', 'target', 'id'),
+        Index('ix_push_outbox_table_target_merge_key', 'target', 'merge_key'),
+        {'mysql_charset': 'utf8mb4'}
+    )
+
+    id = Column(Integer, primary_key=True)
+
+    target = Column(String(255))  # Webhook url
+    payload = Column(UnicodeText)  # JSON payload
+    merge_key = Column(String(64))  # Identifies repeated counter events, None for other events
+    created = Column(BigInteger)  # Unix time in milliseconds
+    claimed_by = Column(String(64))  # Worker delivering the event, None if pending
+    claimed_until = Column(BigInteger)  # Unix time in milliseconds when the claim expires
+
+
+class PushTarget(Base):  # Webhook urls of the outbox, locked while events are added to them
+    __tablename__ = "push_target_table"
+
+    target = Column(String(255), primary_key=True)  # Webhook url
+    last_added = Column(BigInteger)  # Unix time in milliseconds of the last added event
 
 
 class Client(Base):  # Client tokens
@@ -0,0 +1,201 @@
+import asyncio
+import json
+import os
+import socket
+from dataclasses import dataclass
+from time import time
+
+from sqlalchemy import select, delete, update, func, and_, or_
+from sqlalchemy.exc import IntegrityError
+from loguru import logger
+
+from database.db import Database
+from database.models import PushEvent, PushTarget
+from config import PUSH_OUTBOX_LIMIT, PUSH_TIMEOUT, PUSH_RETRIES
+
+'''
+Durable outbox of webhook pushes, one row per event and webhook url.
+Pushes survive restarts and target outages without growing memory,
+each target is bounded to PUSH_OUTBOX_LIMIT pending events, adding events locks the row of the target:
+counter events (which carry a merge key) are merged with an identical pending one,
+and dropped first when the target is full.
+Every worker delivers the events it claims, a claim expires after CLAIM_TIMEOUT seconds
+so events of a crashed worker are delivered by another one.
+A claim covers one push with all its retries, workers renew it before every further push of a batch.
+'''
+
+CLAIM_TIMEOUT: int = max(600, 2 * int(
+    (PUSH_RETRIES + 1) * PUSH_TIMEOUT + sum(min(2 ** attempt, 60) * 1.5 for attempt in range(PUSH_RETRIES))
+))  # seconds, twice the longest push with all its retries and backoff
+
+
+@dataclass
+class OutboxEvent:
+    id: int
+    payload: dict | str
+    created: int  # Unix time in milliseconds
+
+
+class PushOutbox:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.db: Database | None = None
+        self.depth: dict[str, int] = {}  # target -> pending events
+        self.oldest: dict[str, int] = {}  # target -> creation time of the oldest pending event
+        self.dropped: int = 0  # events dropped because their target was full
+        self.worker_id: str = f'{socket.gethostname()}:{os.getpid()}'[:64]
+        self._wakeups: dict[str, asyncio.Event] = {}
+
+    async def load(self, db: Database, targets: list[str]):
+        # replay pending events of configured targets, forget the others
+        self.db = db
+        async with db.async_session() as session:
+            async with session.begin():
+                # without any webhook configured the pending pushes are kept, not all orphaned
+                if targets and (orphaned := (await session.execute(
+                        delete(PushEvent).where(PushEvent.target.not_in(targets))
+                )).rowcount):
+                    logger.warning(f'Dropped {orphaned} pending pushes of webhooks no longer configured')
+                known_targets: list[str] = (await session.execute(select(PushTarget.target))).scalars().all()
+                for target in set(targets) - set(known_targets):
+                    try:
+                        async with session.begin_nested():
+                            session.add(PushTarget(target=target, last_added=0))
+                    except IntegrityError:
+                        pass  # added by another worker starting at the same time
+                for target, depth, oldest in (await session.execute(
+                        select(PushEvent.target, func.count(), func.min(PushEvent.created)).group_by(PushEvent.target)
+                )).all():
+                    self.depth[target] = depth
+                    self.oldest[target] = oldest
+                    logger.info(f'Replaying {depth} pending pushes to {target}')
+        for target in targets:
+            self._wakeup(target).set()
+
+    def _wakeup(self, target: str) -> asyncio.Event:
+        return self._wakeups.setdefault(target, asyncio.Event())
+
+    def wake(self, target: str):
+        self._wakeup(target).set()
+
+    def lag(self, target: str) -> float:
+        # seconds the oldest pending event of the target has been waiting
+        if not self.depth.get(target):
+            return 0
+        return max(0.0, time() - self.oldest[target] / 1000)
+
+    async def add(self, targets: list[str], payload: dict | str, merge_key: str | None = None):
+        created: int = int(time() * 1000)
+        encoded_payload: str = json.dumps(payload, ensure_ascii=False)
+        async with self.db.async_session() as session:
+            async with session.begin():
+                # written before anything is read, so events are added to a target by one worker at a time
+                # and the merge key and limit checks below see the events all workers added
+                await session.execute(
+                    update(PushTarget).where(PushTarget.target.in_(targets)).values(last_added=created)
+                )
+                for target in targets:
+                    if merge_key is not None and (await session.execute(
+                            select(PushEvent.id).where(and_(
+                                PushEvent.target == target, PushEvent.merge_key == merge_key
+                            )).limit(1)
+                    )).first() is not None:
+                        continue  # the same counter event is already pending
+                    depth: int = (await session.execute(
+                        select(func.count()).select_from(PushEvent).where(PushEvent.target == target)
+                    )).scalar()
+                    if depth >= self.limit:
+                        if not await self._evict(session, target, merge_key is not None):
+                            self.dropped += 1
+                            logger.warning(f'Push outbox of {target} is full, dropped an event')
+                            continue
+                        depth -= 1
+                    session.add(PushEvent(target=target, payload=encoded_payload, merge_key=merge_key, created=created))
+                    if not depth:
+                        self.oldest[target] = created
+                    self.depth[target] = depth + 1
+        for target in targets:
+            self._wakeup(target).set()
+
+    async def _evict(self, session, target: str, counter_event: bool) -> bool:
+        # make room by dropping the oldest pending counter event, other events are never dropped for counters
+        evicted = (await session.execute(
+            select(PushEvent.id).where(and_(PushEvent.target == target, PushEvent.merge_key != None))
+            .order_by(PushEvent.id).limit(1)
+        )).scalar()
+        if evicted is None and not counter_event:
+            evicted = (await session.execute(
+                select(PushEvent.id).where(PushEvent.target == target).order_by(PushEvent.id).limit(1)
+            )).scalar()
+        if evicted is None:
+            return False
+        await session.execute(delete(PushEvent).where(PushEvent.id == evicted))
+        self.dropped += 1
+        logger.warning(f'Push outbox of {target} is full, dropped its oldest event')
+        return True
+
+    async def wait(self, target: str):
+        # until events may be pending for the target, or claims of another worker may have expired
+        wakeup = self._wakeup(target)
+        try:
+            await asyncio.wait_for(wakeup.wait(), CLAIM_TIMEOUT)
+        except asyncio.TimeoutError:
+            pass
+        wakeup.clear()
+
+    async def fetch(self, target: str, limit: int) -> list[OutboxEvent]:
+        # claims the oldest pending events of the target no other worker is delivering,
+        # they stay in the outbox until removed
+        now: int = int(time() * 1000)
+        unclaimed = or_(PushEvent.claimed_until == None, PushEvent.claimed_until < now)
+        async with self.db.async_session() as session:
+            async with session.begin():
+                event_ids: list[int] = (await session.execute(
+                    select(PushEvent.id).where(and_(PushEvent.target == target, unclaimed))
+                    .order_by(PushEvent.id).limit(limit).with_for_update(skip_locked=True)
+                )).scalars().all()
+                events: list[PushEvent] = []
+                if event_ids:
+                    # only events still unclaimed are taken, where SKIP LOCKED is not supported
+                    # another worker may have claimed some of them in the meantime
+                    await session.execute(
+                        update(PushEvent).where(and_(PushEvent.id.in_(event_ids), unclaimed))
+                        .values(claimed_by=self.worker_id, claimed_until=now + CLAIM_TIMEOUT * 1000)
+                    )
+                    events = (await session.execute(
+                        select(PushEvent).where(and_(PushEvent.id.in_(event_ids), PushEvent.claimed_by == self.worker_id))
+                        .order_by(PushEvent.id)
+                    )).scalars().all()
+                self.depth[target] = (await session.execute(
+                    select(func.count()).select_from(PushEvent).where(PushEvent.target == target)
+                )).scalar()
+        if not events:
+            return []
+        self.oldest[target] = events[0].created
+        return [OutboxEvent(id=event.id, payload=json.loads(event.payload), created=event.created)
+                for event in events]
+
+    async def renew(self, events: list[OutboxEvent]):
+        # extends the claim of events still being delivered
+        async with self.db.async_session() as session:
+            async with session.begin():
+                await session.execute(
+                    update(PushEvent).where(and_(
+                        PushEvent.id.in_([event.id for event in events]), PushEvent.claimed_by == self.worker_id
+                    )).values(claimed_until=int(time() * 1000) + CLAIM_TIMEOUT * 1000)
+                )
+
+    async def remove(self, target: str, events: list[OutboxEvent]):
+        async with self.db.async_session() as session:
+            async with session.begin():
+                removed = (await session.execute(
+                    delete(PushEvent).where(and_(
+                        PushEvent.id.in_([event.id for event in events]), PushEvent.claimed_by == self.worker_id
+                    ))
+                )).rowcount
+        self.depth[target] = max(0, self.depth.get(target, 0) - removed)
+        if self.depth[target]:
+            self._wakeup(target).set()
+
+
+push_outbox = PushOutbox(limit=PUSH_OUTBOX_LIMIT)
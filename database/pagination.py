@@ -0,0 +1,103 @@
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from collections import OrderedDict
+from enum import Enum
+from time import monotonic
+import json
+
+from sqlalchemy import and_, or_
+
+from database.models import Level
+
+'''
+Keyset pagination for level lists.
+A cursor is the sort key of the last row of the previous page,
+so the database seeks to it instead of skipping OFFSET rows.
+'''
+
+
+class LevelOrdering(Enum):
+    LATEST = "latest"  # Level.id desc
+    OLDEST = "oldest"  # Level.id asc
+    POPULAR = "popular"  # likes - dislikes desc, then Level.id desc
+
+
+def popular_score():
+    return Level.likes - Level.dislikes
+
+
+def order_levels(selection, ordering: LevelOrdering):
+    match ordering:
+        case LevelOrdering.LATEST:
+            return selection.order_by(Level.id.desc())
+        case LevelOrdering.OLDEST:
+            return selection.order_by(Level.id.asc())
+        case LevelOrdering.POPULAR:
+            return selection.order_by(popular_score().desc(), Level.id.desc())
+
+
+def seek_levels(selection, ordering: LevelOrdering, key: list[int]):
+    # keep only the rows after the given sort key
+    match ordering:
+        case LevelOrdering.LATEST:
+            return selection.where(Level.id < key[0])
+        case LevelOrdering.OLDEST:
+            return selection.where(Level.id > key[0])
+        case LevelOrdering.POPULAR:
+            score, level_id = key
+            return selection.where(or_(
+                popular_score() < score,
+                and_(popular_score() == score, Level.id < level_id)
+            ))
+
+
+def level_sort_key(level: Level, ordering: LevelOrdering) -> list[int]:
+    if ordering is LevelOrdering.POPULAR:
+        return [level.likes - level.dislikes, level.id]
+    else:
+        return [level.id]
+
+
+def encode_cursor(ordering: LevelOrdering, key: list[int]) -> str:
+    return urlsafe_b64encode(
+        json.dumps([ordering.value, *key], separators=(',', ':')).encode()
+    ).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, ordering: LevelOrdering) -> list[int] | None:
+    # returns None if the cursor is malformed or belongs to another ordering
+    try:
+        data = json.loads(urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except ValueError:
+        return None
+    if not isinstance(data, list) or len(data) < 2 or data[0] != ordering.value:
+        return None
+    key = data[1:]
+    if len(key) != (2 if ordering is LevelOrdering.POPULAR else 1) or not all(isinstance(i, int) for i in key):
+        return None
+    return key
+
+
+class PageCursorCache:
+    # Remembers where each page of a query starts, so legacy page numbers can be
+    # served with keyset pagination when a client flips through pages in order
+    def __init__(self, max_size: int, ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._cursors: OrderedDict[tuple, tuple[float, str]] = OrderedDict()
+
+    def get(self, query_key: tuple, page: int) -> str | None:
+        item = self._cursors.get((query_key, page))
+        if item is None:
+            return None
+        expires, cursor = item
+        if expires < monotonic():
+            del self._cursors[(query_key, page)]
+            return None
+        self._cursors.move_to_end((query_key, page))
+        return cursor
+
+    def set(self, query_key: tuple, page: int, cursor: str):
+        self._cursors[(query_key, page)] = (monotonic() + self.ttl, cursor)
+        self._cursors.move_to_end((query_key, page))
+        while len(self._cursors) > self.max_size:
+            self._cursors.popitem(last=False)
@@ -0,0 +1,71 @@
+import random
+
+from sqlalchemy import select
+
+from database.db import Database
+from database.models import Level
+
+'''
+Primary keys of levels grouped by difficulty bucket, for O(1) random picks.
+Kept up to date by add_level, delete_level and counter flushes of this worker,
+and reloaded periodically to pick up changes made by other workers.
+'''
+
+ALL_LEVELS = None  # pool key of all levels regardless of difficulty
+
+
+class RandomLevelPool:
+    def __init__(self):
+        self._pools: dict[int | None, list[int]] = {}
+        self._positions: dict[int | None, dict[int, int]] = {}  # pool -> level pk -> index in pool
+        self._difficulties: dict[int, int | None] = {}  # level pk -> difficulty bucket
+
+    def _insert(self, pool_key: int | None, level_pk: int):
+        pool = self._pools.setdefault(pool_key, [])
+        self._positions.setdefault(pool_key, {})[level_pk] = len(pool)
+        pool.append(level_pk)
+
+    def _discard(self, pool_key: int | None, level_pk: int):
+        # swap with the last item so removal stays O(1)
+        pool = self._pools[pool_key]
+        positions = self._positions[pool_key]
+        index = positions.pop(level_pk)
+        last_pk = pool.pop()
+        if last_pk != level_pk:
+            pool[index] = last_pk
+            positions[last_pk] = index
+
+    def add(self, level_pk: int, difficulty: int | None):
+        # add a level or move it to another difficulty bucket
+        if level_pk in self._difficulties:
+            if self._difficulties[level_pk] == difficulty:
+                return
+            self.remove(level_pk)
+        self._insert(ALL_LEVELS, level_pk)
+        if difficulty is not None:
+            self._insert(difficulty, level_pk)
+        self._difficulties[level_pk] = difficulty
+
+    def remove(self, level_pk: int):
+        if level_pk not in self._difficulties:
+            return
+        difficulty = self._difficulties.pop(level_pk)
+        self._discard(ALL_LEVELS, level_pk)
+        if difficulty is not None:
+            self._discard(difficulty, level_pk)
+
+    def choice(self, difficulty: int | None = ALL_LEVELS) -> int | None:
+        pool = self._pools.get(difficulty)
+        if not pool:
+            return None
+        return random.choice(pool)
+
+    async def load(self, db: Database):
+        async with db.async_session() as session:
+            levels = (await session.execute(select(Level.id, Level.difficulty))).all()
+        self._pools, self._positions, self._difficulties = {}, {}, {}
+        for level_pk, difficulty in levels:
+            self.add(level_pk, difficulty)
+
+
+random_level_pool = RandomLevelPool()
@@ -0,0 +1,130 @@
+from sqlalchemy import select, delete, func, or_, case, inspect, text
+from sqlalchemy.dialects.mysql import match
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from loguru import logger
+
+from config import DATABASE_ADAPTER
+from database.db import Database
+from database.models import Level, LevelTrigram
+
+'''
+Title search over Level.name and Level.description, ranked by relevance.
+mysql: FULLTEXT index with the ngram parser, MATCH ... AGAINST
+postgresql: pg_trgm GIN indexes, ILIKE ranked by similarity()
+sqlite: level_trigram_table, an inverted index of character trigrams kept by add_level / delete_level
+Queries shorter than an n-gram, or adapters without the native index, fall back to a LIKE scan.
+'''
+
+TRIGRAM_SIZE: int = 3
+MYSQL_NGRAM_SIZE: int = 2  # default ngram_token_size
+
+
+def trigrams(value: str | None) -> set[str]:
+    value = (value or '').lower()
+    return {value[i:i + TRIGRAM_SIZE] for i in range(len(value) - TRIGRAM_SIZE + 1)}
+
+
+class LevelSearch:
+    def __init__(self, adapter: str):
+        self.adapter = adapter
+        self.indexed: bool = False  # whether the index of the adapter is usable
+
+    async def setup(self, db: Database):
+        # create the native index if missing, run after Database.create_columns
+        # index DDL commits implicitly on MySQL, so it runs outside of any savepoint and is committed right away
+        async with db.engine.connect() as conn:
+            self.indexed = await conn.run_sync(self._setup)
+        if not self.indexed:
+            logger.warning('Title search index is not available, falling back to LIKE scans')
+
+    def _setup(self, conn) -> bool:
+        existing_indexes = {index['name'] for index in inspect(conn).get_indexes(Level.__tablename__)}
+        try:
+            match self.adapter:
+                case 'mysql':
+                    if 'ix_level_table_fulltext' not in existing_indexes:
+                        logger.info('Creating FULLTEXT index ix_level_table_fulltext on level_table')
+                        conn.execute(text(
+                            'CREATE FULLTEXT INDEX ix_level_table_fulltext '
+                            'ON level_table (name, description) WITH PARSER ngram'
+                        ))
+                        conn.commit()
+                case 'postgresql':
+                    conn.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+                    for column in ('name', 'description'):
+                        conn.execute(text(
+                            f'CREATE INDEX IF NOT EXISTS ix_level_table_{column}_trgm '
+                            f'ON level_table USING gin ({column} gin_trgm_ops)'
+                        ))
+                    conn.commit()
+                case 'sqlite':
+                    if (
+                            conn.execute(select(func.count()).select_from(LevelTrigram)).scalar() == 0
+                            and conn.execute(select(func.count()).select_from(Level)).scalar() != 0
+                    ):
+                        logger.warning('Title search index is empty, run `python -m database.backfill search` to fill it')
+        except SQLAlchemyError as e:
+            conn.rollback()
+            if self.adapter == 'mysql' and 'ix_level_table_fulltext' in {
+                index['name'] for index in inspect(conn).get_indexes(Level.__tablename__)
+            }:
+                return True
+            logger.error(f'Failed to create title search index: {e}')
+            return False
+        return True
+
+    def apply(self, selection, title: str):
+        # returns the filtered selection and a relevance expression to order by
+        if not self.indexed:
+            return self._like(selection, title), None
+        match self.adapter:
+            case 'mysql' if len(title) >= MYSQL_NGRAM_SIZE:
+                relevance = match(
+                    Level.name, Level.description,
+                    against='"' + title.replace('"', ' ') + '"'  # phrase search
+                ).in_boolean_mode()
+                return selection.where(relevance), relevance
+            case 'postgresql':
+                return selection.where(or_(
+                    Level.name.icontains(title, autoescape=True),
+                    Level.description.icontains(title, autoescape=True)
+                )), func.similarity(Level.name, title)
+            case 'sqlite' if len(title) >= TRIGRAM_SIZE:
+                title_trigrams = trigrams(title)
+                candidates = select(LevelTrigram.parent_id).where(
+                    LevelTrigram.trigram.in_(title_trigrams)
+                ).group_by(LevelTrigram.parent_id).having(
+                    func.count(LevelTrigram.trigram.distinct()) == len(title_trigrams)
+                )
+                # trigrams narrow down the candidates, LIKE drops the false positives
+                return self._like(selection.where(Level.id.in_(candidates)), title), \
+                    case((Level.name.contains(title, autoescape=True), 1), else_=0)
+            case _:
+                return self._like(selection, title), None
+
+    @staticmethod
+    def _like(selection, title: str):
+        return selection.where(or_(
+            Level.name.contains(title, autoescape=True),
+            Level.description.contains(title, autoescape=True)
+        ))
+
+    async def index_level(self, session: AsyncSession, level: Level):
+        if self.adapter != 'sqlite':
+            return  # maintained by the database
+        session.add_all([
+            LevelTrigram(parent_id=level.id, trigram=trigram)
+            for trigram in trigrams(level.name) | trigrams(level.description)
+        ])
+        await session.flush()
+
+    async def unindex_level(self, session: AsyncSession, level: Level):
+        if self.adapter != 'sqlite':
+            return
+        await session.execute(
+            delete(LevelTrigram).where(LevelTrigram.parent_id == level.id)
+        )
+
+
+level_search = LevelSearch(DATABASE_ADAPTER)
@@ -0,0 +1,56 @@
+from sqlalchemy import select, func, event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, SessionTransaction
+
+from database.db import Database
+from database.models import User, Level
+
+'''
+Player and level totals shown on /server_stats.
+Kept up to date by add_user, add_level and delete_level of this worker once their transaction commits,
+and reconciled periodically with the database to pick up other workers, so they are approximate in between.
+'''
+
+
+class SiteTotals:
+    def __init__(self):
+        self.players: int = 0
+        self.levels: int = 0
+
+    def add_player(self, session: AsyncSession):
+        self._pending(session)[0] += 1
+
+    def add_level(self, session: AsyncSession):
+        self._pending(session)[1] += 1
+
+    def remove_level(self, session: AsyncSession):
+        self._pending(session)[1] -= 1
+
+    @staticmethod
+    def _pending(session: AsyncSession) -> list[int]:
+        # [players, levels] changed in the session's transaction
+        return session.info.setdefault('site_totals', [0, 0])
+
+    def _after_commit(self, session: Session):
+        if session.in_nested_transaction():
+            return  # a released savepoint, the outer transaction may still roll back
+        players, levels = session.info.pop('site_totals', (0, 0))
+        self.players += players
+        self.levels = max(0, self.levels + levels)
+
+    @staticmethod
+    def _after_soft_rollback(session: Session, previous_transaction: SessionTransaction):
+        # rolled back savepoints and failed flushes inside them leave the outer transaction to commit
+        if previous_transaction.parent is None:
+            session.info.pop('site_totals', None)
+
+    async def load(self, db: Database):
+        async with db.async_session() as session:
+            self.players = (await session.execute(select(func.count()).select_from(User))).scalar()
+            self.levels = (await session.execute(select(func.count()).select_from(Level))).scalar()
+
+
+site_totals = SiteTotals()
+# AsyncSession runs its transactions on a sync Session, whose events see the same info dict
+event.listen(Session, 'after_commit', site_totals._after_commit)
+event.listen(Session, 'after_soft_rollback', site_totals._after_soft_rollback)
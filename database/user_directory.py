@@ -0,0 +1,83 @@
+from collections import OrderedDict
+
+from redis.asyncio import Redis
+from loguru import logger
+
+from config import USER_DIRECTORY_CACHE_SIZE, USER_DIRECTORY_PUBSUB
+
+'''
+In-process directory of user identifiers: id -> (username, im_id), plus username -> id and im_id -> id.
+Only identifiers are kept, full user rows (permissions, password hash) are always read from the database.
+Workers tell each other to drop entries through the user_directory:invalidate channel.
+'''
+
+INVALIDATE_CHANNEL: str = "user_directory:invalidate"
+
+
+class UserDirectory:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._users: OrderedDict[int, tuple[str, int]] = OrderedDict()  # LRU
+        self._ids_by_username: dict[str, int] = {}
+        self._ids_by_im_id: dict[int, int] = {}
+
+    def get_username(self, user_id: int) -> str | None:
+        item = self._users.get(user_id)
+        if item is None:
+            return None
+        self._users.move_to_end(user_id)
+        return item[0]
+
+    def get_id_by_username(self, username: str) -> int | None:
+        return self._ids_by_username.get(username)
+
+    def get_id_by_im_id(self, im_id: int) -> int | None:
+        return self._ids_by_im_id.get(im_id)
+
+    def add(self, user_id: int, username: str, im_id: int):
+        self.invalidate(user_id)
+        self._users[user_id] = (username, im_id)
+        self._ids_by_username[username] = user_id
+        self._ids_by_im_id[im_id] = user_id
+        while len(self._users) > self.max_size:
+            self.invalidate(next(iter(self._users)))
+
+    def invalidate(self, user_id: int):
+        item = self._users.pop(user_id, None)
+        if item is None:
+            return
+        username, im_id = item
+        if self._ids_by_username.get(username) == user_id:
+            del self._ids_by_username[username]
+        if self._ids_by_im_id.get(im_id) == user_id:
+            del self._ids_by_im_id[im_id]
+
+    def clear(self):
+        self._users.clear()
+        self._ids_by_username.clear()
+        self._ids_by_im_id.clear()
+
+
+user_directory = UserDirectory(max_size=USER_DIRECTORY_CACHE_SIZE)
+
+
+async def publish_invalidation(redis: Redis, user_id: int):
+    # the local entry is already dropped by the DAL, tell the other workers
+    if USER_DIRECTORY_PUBSUB:
+        await redis.publish(INVALIDATE_CHANNEL, user_id)
+
+
+async def listen_for_invalidations(redis: Redis):
+    if not USER_DIRECTORY_PUBSUB:
+        return
+    async with redis.pubsub() as pubsub:
+        await pubsub.subscribe(INVALIDATE_CHANNEL)
+        # entries may have gone stale while we were not subscribed
+        user_directory.clear()
+        async for message in pubsub.listen():
+            if message['type'] != 'message':
+                continue
+            try:
+                user_directory.invalidate(int(message['data']))
+            except ValueError:
+                logger.warning(f'Invalid user directory invalidation: {message["data"]}')
@@ -48,6 +48,3 @@ async def verify_and_get_session(request: Request):
         )
     return session
 
-
-def connection_count_inc(request: Request):
-    request.app.state.connection_count += 1
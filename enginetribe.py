@@ -3,9 +3,10 @@
 import datetime
 import platform
 from contextlib import asynccontextmanager
+from time import monotonic
 import uvicorn
 from fastapi import (
-    FastAPI, Request, status, Depends
+    FastAPI, Request, status
 )
 from fastapi.responses import (
     RedirectResponse, JSONResponse, FileResponse, Response
@@ -15,35 +16,116 @@ from fastapi.staticfiles import StaticFiles
 from redis import asyncio as redis
 import asyncio
 import aiohttp
+import orjson
+from loguru import logger
 
-from database.db_access import DBAccessLayer
 import routers
 from config import *
 from models import ErrorMessageException
 import push
+import leaderboard
+import metrics
+from ingest import level_ingest
 from database.db import Database
+from database.counters import level_counters
+from database.random_pool import random_level_pool
+from database.search import level_search
+from database.totals import site_totals
+from database.outbox import push_outbox
+from database.user_directory import listen_for_invalidations as listen_for_user_invalidations
+from session.session_access import listen_for_invalidations as listen_for_session_invalidations
 from storage.onedrive_cf import StorageProviderOneDriveCF
 from storage.onemanager import StorageProviderOneManager
 from storage.database import StorageProviderDatabase
-from depends import (
-    create_dal
-)
+from storage.filesystem import StorageProviderFilesystem
+
+
+# game API routes counted as connections, /metrics scrapes, static files and web pages are left out
+CONNECTION_ROUTE_PREFIXES: tuple[str, ...] = ("/stage", "/user", "/client")
+
+
+def connection_count() -> float:
+    # derived from the request counter of /metrics
+    return sum(count for (route, _method, _status), count in metrics.http_requests.values.items()
+               if route.startswith(CONNECTION_ROUTE_PREFIXES))
 
 
 async def connection_per_minute_record():
-    await asyncio.sleep(60)
-    app.state.connection_per_minute = app.state.connection_count
-    app.state.connection_count = 0
-    asyncio.create_task(connection_per_minute_record())
+    last_count: float = connection_count()
+    while True:
+        await asyncio.sleep(60)
+        count: float = connection_count()
+        app.state.connection_per_minute = int(count - last_count)
+        last_count = count
+
+
+async def flush_level_counters():
+    for milestone in await level_counters.flush(app.state.db):
+        await push.push_counter_milestone(
+            counter=milestone.counter,
+            value=milestone.value,
+            level_id=milestone.level_id,
+            level_name=milestone.level_name,
+            author_name=milestone.author_name
+        )
+
+
+async def level_counters_flush_loop():
+    while True:
+        await asyncio.sleep(COUNTERS_FLUSH_INTERVAL)
+        try:
+            await flush_level_counters()
+        except Exception as e:
+            logger.error(f'Failed to flush level counters: {e}')
+
+
+async def random_level_pool_refresh_loop():
+    while True:
+        await asyncio.sleep(SEARCH_RANDOM_POOL_REFRESH_INTERVAL)
+        try:
+            await random_level_pool.load(app.state.db)
+        except Exception as e:
+            logger.error(f'Failed to reload random level pool: {e}')
+
+
+async def site_totals_reconcile_loop():
+    while True:
+        await asyncio.sleep(STATS_RECONCILE_INTERVAL)
+        try:
+            await site_totals.load(app.state.db)
+        except Exception as e:
+            logger.error(f'Failed to reconcile player and level totals: {e}')
+
+
+async def user_directory_invalidation_loop():
+    while True:
+        try:
+            await listen_for_user_invalidations(app.state.redis)
+            return
+        except Exception as e:
+            logger.error(f'Lost user directory invalidations: {e}')
+            await asyncio.sleep(5)
+
+
+async def session_invalidation_loop():
+    while True:
+        try:
+            await listen_for_session_invalidations(app.state.redis)
+        except Exception as e:
+            logger.error(f'Lost session invalidations: {e}')
+            await asyncio.sleep(5)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     app.state.start_time = datetime.datetime.now()
     app.state.db = Database()
+    metrics.instrument_engine(app.state.db.engine)
     await app.state.db.create_columns()
-    app.state.connection_count = 0
-    app.state.storage = {
+    await level_search.setup(app.state.db)
+    await random_level_pool.load(app.state.db)
+    await site_totals.load(app.state.db)
+    app.state.storage = metrics.instrument_storage({
         "onedrive-cf": StorageProviderOneDriveCF(
             url=STORAGE_URL, auth_key=STORAGE_AUTH_KEY, proxied=STORAGE_PROXIED
         ),
@@ -53,22 +135,37 @@ async def lifespan(app: FastAPI):
         "database": StorageProviderDatabase(
             base_url=API_ROOT,
             database=app.state.db
+        ),
+        "filesystem": StorageProviderFilesystem(
+            base_url=API_ROOT,
+            path=STORAGE_PATH
         )
-    }[STORAGE_PROVIDER]
+    }[STORAGE_PROVIDER])
     app.state.redis = redis.Redis(
         connection_pool=redis.ConnectionPool(
             host=SESSION_REDIS_HOST,
             port=SESSION_REDIS_PORT,
             db=SESSION_REDIS_DB,
-            password=SESSION_REDIS_PASS
+            password=SESSION_REDIS_PASS,
+            connection_class=metrics.InstrumentedRedisConnection
         )
     )
-    app.state.connection_count = 0
     app.state.connection_per_minute = 0
+    await leaderboard.rebuild(app.state.redis, app.state.db)
+    level_ingest.start()
     asyncio.create_task(connection_per_minute_record())
-    asyncio.create_task(push.push_to_engine_bot_sub())
-    asyncio.create_task(push.push_to_engine_bot_discord_sub())
+    asyncio.create_task(metrics.event_loop_lag_loop())
+    await push.load_push_outbox(app.state.db)
+    push.start_push_subs()
+    asyncio.create_task(level_counters_flush_loop())
+    asyncio.create_task(random_level_pool_refresh_loop())
+    asyncio.create_task(site_totals_reconcile_loop())
+    asyncio.create_task(user_directory_invalidation_loop())
+    asyncio.create_task(session_invalidation_loop())
     yield
+    level_ingest.shutdown()
+    await flush_level_counters()
+    await push.close_push_sessions()
     await app.state.redis.flushdb()
     await app.state.redis.close()
 
@@ -83,6 +180,7 @@ app.include_router(routers.stage.router)
 app.include_router(routers.user.router)
 app.include_router(routers.client.router)
 
+app.add_middleware(metrics.MetricsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=CORS_ALLOWED_ORIGINS,
@@ -132,20 +230,35 @@ async def docs_handler() -> RedirectResponse:
     return RedirectResponse("http://www.enginetribe.gq/docs")
 
 
+_platform_name: str = platform.platform().replace('-', ' ')
+_server_stats_payload: bytes = b''
+_server_stats_expires: float = 0
+
+
 # get server status
 @app.get("/server_stats")
-async def server_stats(
-        dal: DBAccessLayer = Depends(create_dal),
-        request: Request
-) -> dict:
-    return {
-        "os": platform.platform().replace('-', ' '),
-        "python": platform.python_version(),
-        "player_count": await dal.get_player_count(),
-        "level_count": await dal.get_level_count(),
-        "uptime": (datetime.datetime.now() - request.app.state.start_time).seconds,
-        "connection_per_minute": request.app.state.connection_per_minute,
-    }
+async def server_stats(request: Request) -> Response:
+    # bots poll this constantly, serve the encoded payload for STATS_CACHE_TTL seconds
+    global _server_stats_payload, _server_stats_expires
+    if monotonic() >= _server_stats_expires:
+        _server_stats_payload = orjson.dumps({
+            "os": _platform_name,
+            "python": platform.python_version(),
+            "player_count": site_totals.players,
+            "level_count": site_totals.levels,
+            "uptime": (datetime.datetime.now() - request.app.state.start_time).seconds,
+            "connection_per_minute": request.app.state.connection_per_minute,
+            "upload_queue_depth": level_ingest.queue_depth,
+            "push_outbox_depth": sum(push_outbox.depth.values()),
+            "push_outbox_lag": round(max(map(push_outbox.lag, push_outbox.depth), default=0), 1),
+        })
+        _server_stats_expires = monotonic() + STATS_CACHE_TTL
+    return Response(content=_server_stats_payload, media_type="application/json")
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_handler() -> Response:
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
 
 
 @app.exception_handler(ErrorMessageException)
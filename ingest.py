@@ -0,0 +1,67 @@
+import asyncio
+import multiprocessing
+import sys
+import types
+from concurrent.futures import ProcessPoolExecutor
+
+from level_file import gen_level_ids, PreparedLevel
+from config import INGEST_WORKERS, INGEST_MAX_QUEUE
+
+'''
+CPU heavy upload work (base64 decoding, stripping and hashing levels) runs in worker processes,
+so a large upload does not stall other requests on the event loop.
+At most INGEST_WORKERS uploads are handed to the pool at once, further ones wait in the event loop,
+and uploads beyond INGEST_MAX_QUEUE waiting or running ones are rejected.
+Workers only import level_file and send back the level ids, the payload stays in the server process.
+Spawned processes also re-run the main module, which is the whole server when it is started with
+`python enginetribe.py`, so start() launches every worker upfront with the main module hidden.
+'''
+
+
+class IngestQueueFull(Exception):
+    pass
+
+
+class LevelIngestPool:
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.queue_depth: int = 0  # uploads waiting for or running in a worker
+        self._slots = asyncio.Semaphore(workers)
+        self._executor: ProcessPoolExecutor | None = None
+
+    def start(self):
+        # spawned workers do not inherit the event loop, connections or threads of the server
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+        # workers are launched as tasks are submitted and live as long as the pool,
+        # so submitting one task per worker here launches all of them without importing the server
+        main_module = sys.modules['__main__']
+        sys.modules['__main__'] = types.ModuleType('__main__')
+        try:
+            for _ in range(self.workers):
+                self._executor.submit(int)
+        finally:
+            sys.modules['__main__'] = main_module
+
+    def shutdown(self):
+        if self._executor is not None:
+            # do not block the event loop on running preparations, their uploads are being cancelled too
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def prepare_level(self, swe: str) -> PreparedLevel:
+        if self.queue_depth >= self.max_queue:
+            raise IngestQueueFull
+        self.queue_depth += 1
+        try:
+            async with self._slots:
+                level_ids = await asyncio.get_running_loop().run_in_executor(self._executor, gen_level_ids, swe)
+        finally:
+            self.queue_depth -= 1
+        return PreparedLevel(payload=swe.encode(), level_ids=level_ids)
+
+
+level_ingest = LevelIngestPool(workers=INGEST_WORKERS, max_queue=INGEST_MAX_QUEUE)
@@ -0,0 +1,138 @@
+import datetime
+
+from redis.asyncio import Redis
+from sqlalchemy import select
+
+from database.db import Database
+from database.models import Level
+
+'''
+Popular level rankings, scored by likes - dislikes:
+leaderboard:popular:{scope} -> level_table.id, all time
+leaderboard:popular_recent:{scope} -> level_table.id, levels uploaded in the last POPULAR_RECENT_DAYS days
+leaderboard:uploaded -> level_table.id scored by upload date ordinal, to expire popular_recent entries
+scope "all" ranks every level (testing client), "stable" leaves testing-client levels out
+Members are zero-padded level_table.ids: Redis orders equal scores by member bytes,
+so padding keeps ties ordered by id like the database (likes - dislikes desc, id desc).
+'''
+
+POPULAR_RECENT_DAYS: int = 7
+REBUILD_BATCH_SIZE: int = 5000
+REBUILD_LOCK_TTL: int = 600  # seconds, bounds how long a crashed rebuild blocks the others
+RANKING_KEYS: list[str] = [
+    f"leaderboard:{ranking}:{scope}" for ranking in ("popular", "popular_recent") for scope in ("all", "stable")
+] + ["leaderboard:uploaded"]
+
+
+def _member(level_pk: int) -> str:
+    return f"{level_pk:010d}"
+
+
+def _scopes(testing_client: bool) -> list[str]:
+    return ["all"] if testing_client else ["all", "stable"]
+
+
+async def add_level(redis: Redis, level_pk: int, testing_client: bool, date: datetime.date, score: int = 0):
+    async with redis.pipeline(transaction=False) as pipe:
+        for scope in _scopes(testing_client):
+            pipe.zadd(f"leaderboard:popular:{scope}", {_member(level_pk): score})
+            pipe.zadd(f"leaderboard:popular_recent:{scope}", {_member(level_pk): score})
+        pipe.zadd("leaderboard:uploaded", {_member(level_pk): date.toordinal()})
+        await pipe.execute()
+
+
+async def remove_level(redis: Redis, level_pk: int):
+    async with redis.pipeline(transaction=False) as pipe:
+        for scope in _scopes(testing_client=False):
+            pipe.zrem(f"leaderboard:popular:{scope}", _member(level_pk))
+            pipe.zrem(f"leaderboard:popular_recent:{scope}", _member(level_pk))
+        pipe.zrem("leaderboard:uploaded", _member(level_pk))
+        await pipe.execute()
+
+
+async def change_score(redis: Redis, level_pk: int, amount: int):
+    # +1 on like, -1 on dislike; only touches rankings the level is already in
+    async with redis.pipeline(transaction=False) as pipe:
+        for scope in _scopes(testing_client=False):
+            pipe.zadd(f"leaderboard:popular:{scope}", {_member(level_pk): amount}, xx=True, incr=True)
+            pipe.zadd(f"leaderboard:popular_recent:{scope}", {_member(level_pk): amount}, xx=True, incr=True)
+        await pipe.execute()
+
+
+async def expire_recent(redis: Redis):
+    # drop levels uploaded before the popular_recent window
+    cutoff: int = (datetime.date.today() - datetime.timedelta(days=POPULAR_RECENT_DAYS)).toordinal()
+    expired = await redis.zrangebyscore("leaderboard:uploaded", "-inf", f"({cutoff}")
+    if not expired:
+        return
+    async with redis.pipeline(transaction=False) as pipe:
+        for scope in _scopes(testing_client=False):
+            pipe.zrem(f"leaderboard:popular_recent:{scope}", *expired)
+        pipe.zrem("leaderboard:uploaded", *expired)
+        await pipe.execute()
+
+
+async def get_popular_level_page(
+        redis: Redis,
+        recent: bool,
+        testing_client: bool,
+        offset: int,
+        count: int
+) -> tuple[list[int], int]:
+    # returns the ranked level_table.ids of a page and the number of ranked levels
+    if recent:
+        await expire_recent(redis)
+    key: str = f"leaderboard:{'popular_recent' if recent else 'popular'}:{'all' if testing_client else 'stable'}"
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.zrevrange(key, offset, offset + count - 1)
+        pipe.zcard(key)
+        level_pks, num_rows = await pipe.execute()
+    return [int(level_pk) for level_pk in level_pks], num_rows
+
+
+async def rebuild(redis: Redis, db: Database):
+    # rankings live in Redis only, so the first worker to start rebuilds them from the database;
+    # they are built under temporary keys and renamed into place, live keys are never wiped
+    if await redis.exists("leaderboard:built"):
+        return
+    if not await redis.set("leaderboard:rebuild_lock", 1, nx=True, ex=REBUILD_LOCK_TTL):
+        return  # another worker is rebuilding
+    try:
+        await _build(redis, db)
+        await redis.set("leaderboard:built", 1)
+    finally:
+        await redis.delete("leaderboard:rebuild_lock")
+
+
+async def _build(redis: Redis, db: Database):
+    temporary_keys: list[str] = [f"{key}:rebuild" for key in RANKING_KEYS]
+    await redis.delete(*temporary_keys)
+    cutoff: datetime.date = datetime.date.today() - datetime.timedelta(days=POPULAR_RECENT_DAYS)
+    async with db.async_session() as session:
+        result = await session.stream(
+            select(Level.id, Level.likes, Level.dislikes, Level.testing_client, Level.date)
+            .execution_options(yield_per=REBUILD_BATCH_SIZE)
+        )
+        async for levels in result.partitions(REBUILD_BATCH_SIZE):
+            async with redis.pipeline(transaction=False) as pipe:
+                for level_pk, likes, dislikes, testing_client, date in levels:
+                    for scope in _scopes(testing_client):
+                        pipe.zadd(f"leaderboard:popular:{scope}:rebuild", {_member(level_pk): likes - dislikes})
+                        if date >= cutoff:
+                            pipe.zadd(f"leaderboard:popular_recent:{scope}:rebuild",
+                                      {_member(level_pk): likes - dislikes})
+                    if date >= cutoff:
+                        pipe.zadd("leaderboard:uploaded:rebuild", {_member(level_pk): date.toordinal()})
+                await pipe.execute()
+    # empty rankings have no temporary key to rename
+    async with redis.pipeline(transaction=False) as pipe:
+        for temporary_key in temporary_keys:
+            pipe.exists(temporary_key)
+        built = await pipe.execute()
+    async with redis.pipeline(transaction=True) as pipe:
+        for key, temporary_key, exists in zip(RANKING_KEYS, temporary_keys, built):
+            if exists:
+                pipe.rename(temporary_key, key)
+            else:
+                pipe.delete(key)
+        await pipe.execute()
@@ -0,0 +1,71 @@
+import base64
+from dataclasses import dataclass
+from functools import cached_property
+import hashlib
+import re
+
+'''
+Decoding and level id generation of uploaded .swe files.
+gen_level_ids runs in the ingest worker processes, which import this module alone,
+so it must not import the server (config, database, locales).
+'''
+
+_level_time_regex = re.compile(b'"time": ".*?"')
+_level_date_regex = re.compile(b'"date": ".*?"')
+
+
+@dataclass
+class PreparedLevel:
+    # An uploaded .swe with its level ids, shared by the upload handler and storage providers
+    payload: bytes  # .swe as uploaded, base64 level data followed by the checksum
+    level_ids: tuple[str, str, str]  # md5, sha1 and sha256 level ids, in fallback order
+
+    @property
+    def checksum(self) -> str:
+        # SHA-1 HMAC checksum, last 40 characters of the payload
+        return self.payload[-40:].decode()
+
+    @cached_property
+    def level_data(self) -> bytes:
+        # decoded level data without checksum, only the database storage provider needs it
+        return base64.b64decode(memoryview(self.payload)[:-40])
+
+
+def prepare_level(swe: str) -> PreparedLevel:
+    return PreparedLevel(payload=swe.encode(), level_ids=gen_level_ids(swe))
+
+
+def gen_level_ids(swe: str) -> tuple[str, str, str]:
+    # raises binascii.Error if the .swe is not valid base64
+    payload: bytes = swe.encode()
+    if payload[-41:-40] == b'=':
+        # level ids have always been generated from the level data decoded together with the checksum,
+        # which only differs when the level data is padded
+        stripped_level: bytes = strip_level(base64.b64decode(payload)[:-30])
+    else:
+        stripped_level: bytes = strip_level(base64.b64decode(memoryview(payload)[:-40]))
+    return (
+        gen_level_id_md5(stripped_level),
+        gen_level_id_sha1(stripped_level),
+        gen_level_id_sha256(stripped_level)
+    )
+
+
+def gen_level_id_md5(stripped_level: bytes) -> str:
+    return prettify_level_id(hashlib.md5(stripped_level).hexdigest().upper()[8:24])
+
+
+def gen_level_id_sha1(stripped_level: bytes) -> str:
+    return prettify_level_id(hashlib.sha1(stripped_level).hexdigest().upper()[8:24])
+
+
+def gen_level_id_sha256(stripped_level: bytes) -> str:
+    return prettify_level_id(hashlib.sha256(stripped_level).hexdigest().upper()[8:24])
+
+
+def strip_level(level_data: bytes) -> bytes:
+    return _level_date_regex.sub(b'"date": ""', _level_time_regex.sub(b'"time": ""', level_data))
+
+
+def prettify_level_id(level_id: str):
+    return level_id[0:4] + '-' + level_id[4:8] + '-' + level_id[8:12] + '-' + level_id[12:16]
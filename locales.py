@@ -26,6 +26,7 @@ class LocaleModel:
     UPLOAD_LIMIT_REACHED: str
     LEVEL_NOT_FOUND: str
     UPLOAD_CONNECT_ERROR: str
+    UPLOAD_QUEUE_FULL: str
     UNKNOWN_DIFFICULTY: str
     UNKNOWN_QUERY_MODE: str
     LEVEL_ID_REPEAT: str
@@ -43,6 +44,7 @@ class CN(LocaleModel):
     UPLOAD_LIMIT_REACHED: str = '关卡发布数量已达上限。'
     LEVEL_NOT_FOUND: str = '找不到关卡。'
     UPLOAD_CONNECT_ERROR: str = '连接关卡存储后端失败。'
+    UPLOAD_QUEUE_FULL: str = '服务器繁忙，请稍后重新上传。'
     UNKNOWN_DIFFICULTY: str = '未知难度。'
     UNKNOWN_QUERY_MODE: str = '未知查询模式。'
     LEVEL_ID_REPEAT: str = '关卡已存在'
@@ -60,6 +62,7 @@ class ES(LocaleModel):
     UPLOAD_LIMIT_REACHED: str = 'Se alcanzó el máximo de niveles posible para publicar.'
     LEVEL_NOT_FOUND: str = 'Nivel no encontrado.'
     UPLOAD_CONNECT_ERROR: str = 'No se pudo conectar al backend de nivel.'
+    UPLOAD_QUEUE_FULL: str = 'El servidor está ocupado, vuelve a subir el nivel más tarde.'
     UNKNOWN_DIFFICULTY: str = 'Dificultad desconocida.'
     UNKNOWN_QUERY_MODE: str = 'Modo de consulta desconocido.'
     LEVEL_ID_REPEAT: str = 'El nivel ya existe.'
@@ -77,6 +80,7 @@ class EN(LocaleModel):
     UPLOAD_LIMIT_REACHED: str = 'You have reached the upload limit.'
     LEVEL_NOT_FOUND: str = 'Level not found.'
     UPLOAD_CONNECT_ERROR: str = 'Could not connect to the storage backend.'
+    UPLOAD_QUEUE_FULL: str = 'The server is busy, please upload again later.'
     UNKNOWN_DIFFICULTY: str = 'Unknown difficulty.'
     UNKNOWN_QUERY_MODE: str = 'Unknown query mode.'
     LEVEL_ID_REPEAT: str = 'Level already exists.'
@@ -94,6 +98,7 @@ class PT(LocaleModel):
     UPLOAD_LIMIT_REACHED: str = 'Você atingiu o limite de upload.'
     LEVEL_NOT_FOUND: str = 'Nível não encontrado.'
     UPLOAD_CONNECT_ERROR: str = 'Não foi possível conectar ao back-end de armazenamento.'
+    UPLOAD_QUEUE_FULL: str = 'O servidor está ocupado, envie o nível novamente mais tarde.'
     UNKNOWN_DIFFICULTY: str = 'Dificuldade desconhecida.'
     UNKNOWN_QUERY_MODE: str = 'Modo de consulta desconhecido.'
     LEVEL_ID_REPEAT: str = 'O nível já existe.'
@@ -111,6 +116,7 @@ class IT(LocaleModel):
     UPLOAD_LIMIT_REACHED: str = 'Hai raggiunto il limite di caricamento.'
     LEVEL_NOT_FOUND: str = 'Livello non trovato.'
     UPLOAD_CONNECT_ERROR: str = 'Impossibile connettersi al back-end di archiviazione.'
+    UPLOAD_QUEUE_FULL: str = 'Il server è occupato, riprova a caricare più tardi.'
     UNKNOWN_DIFFICULTY: str = 'Difficoltà sconosciuta.'
     UNKNOWN_QUERY_MODE: str = 'Modalità query sconosciuta.'
     LEVEL_ID_REPEAT: str = 'Il livello esiste già.'
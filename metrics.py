@@ -0,0 +1,306 @@
+from abc import ABC, abstractmethod
+import asyncio
+from bisect import bisect_left
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from time import perf_counter
+from typing import Callable
+
+from redis.asyncio import Connection as RedisConnection
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from loguru import logger
+
+from config import (
+    DATABASE_DEBUG_HEADERS,
+    DATABASE_QUERY_BUDGET,
+    DATABASE_REPEAT_LIMIT,
+    DATABASE_STRICT_QUERY_BUDGET
+)
+from database.outbox import push_outbox
+from ingest import level_ingest
+
+'''
+In-process metrics, exported in the Prometheus text format on /metrics.
+Recording is a dict lookup and an addition, so every request, query and Redis round trip is measured.
+Each worker exports its own numbers, scrape every worker (or sum them up) when running several.
+'''
+
+LATENCY_BUCKETS: tuple[float, ...] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS: tuple[float, ...] = (0, 1, 2, 5, 10, 20, 50, 100)
+
+_metrics: list['Metric'] = []
+
+
+def _format_labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Metric(ABC):
+    type: str = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        _metrics.append(self)
+
+    def render(self) -> list[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}'] + self.samples()
+
+    @abstractmethod
+    def samples(self) -> list[str]:
+        ...
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self) -> list[str]:
+        return [f'{self.name}{_format_labels(self.labels, key)} {value}' for key, value in self.values.items()]
+
+
+class Gauge(Metric):
+    # value is read from a callback at scrape time
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], float]):
+        super().__init__(name, documentation)
+        self.callback = callback
+
+    def samples(self) -> list[str]:
+        return [f'{self.name} {self.callback()}']
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+        # label values -> [count per bucket..., count above the last bucket, sum]
+        self.series: dict[tuple, list[float]] = {}
+
+    def observe(self, value: float, *label_values):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self) -> list[str]:
+        lines = []
+        for key, series in self.series.items():
+            cumulative = 0
+            for bucket, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                labels = _format_labels(self.labels + ('le',), key + (bucket,))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labels, key)
+            lines.append(f'{self.name}_sum{labels} {series[-1]}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+def render() -> bytes:
+    lines = []
+    for metric in _metrics:
+        lines += metric.render()
+    return ('\n'.join(lines) + '\n').encode()
+
+
+http_requests = Counter(
+    'enginetribe_http_requests_total', 'HTTP requests handled', ('route', 'method', 'status')
+)
+http_request_duration = Histogram(
+    'enginetribe_http_request_duration_seconds', 'Time spent handling HTTP requests', ('route', 'method')
+)
+http_request_db_queries = Histogram(
+    'enginetribe_http_request_db_queries', 'Database queries per HTTP request', ('route',), COUNT_BUCKETS
+)
+http_request_db_duration = Histogram(
+    'enginetribe_http_request_db_duration_seconds', 'Time spent in database queries per HTTP request', ('route',)
+)
+http_request_redis_round_trips = Histogram(
+    'enginetribe_http_request_redis_round_trips', 'Redis round trips per HTTP request', ('route',), COUNT_BUCKETS
+)
+db_query_duration = Histogram(
+    'enginetribe_db_query_duration_seconds', 'Time spent in database queries'
+)
+redis_round_trips = Counter(
+    'enginetribe_redis_round_trips_total', 'Commands or pipelines sent to Redis'
+)
+storage_duration = Histogram(
+    'enginetribe_storage_duration_seconds', 'Time spent in storage provider calls', ('provider', 'operation')
+)
+query_budget_exceeded = Counter(
+    'enginetribe_query_budget_exceeded_total', 'HTTP requests over the query budget or repeating a statement',
+    ('route', 'reason')
+)
+event_loop_lag = Histogram(
+    'enginetribe_event_loop_lag_seconds', 'Delay of a timer on the event loop beyond its deadline'
+)
+upload_queue_depth = Gauge(
+    'enginetribe_upload_queue_depth', 'Uploaded levels waiting for or in preparation',
+    lambda: level_ingest.queue_depth
+)
+push_outbox_depth = Gauge(
+    'enginetribe_push_outbox_depth', 'Webhook pushes not delivered yet',
+    lambda: sum(push_outbox.depth.values())
+)
+push_outbox_lag = Gauge(
+    'enginetribe_push_outbox_lag_seconds', 'Time the oldest undelivered webhook push has waited',
+    lambda: max(map(push_outbox.lag, push_outbox.depth), default=0)
+)
+
+
+@dataclass
+class RequestMetrics:
+    db_queries: int = 0
+    db_duration: float = 0
+    db_rows: int = 0  # changed by INSERT, UPDATE and DELETE, selected rows are not known before they are fetched
+    redis_round_trips: int = 0
+    statements: dict[str, int] = field(default_factory=dict)  # statement -> runs, only with a repeat limit
+
+    def most_repeated(self) -> tuple[str, int]:
+        return max(self.statements.items(), key=lambda item: item[1], default=('', 0))
+
+
+class QueryBudgetExceeded(Exception):
+    # raised by the query that breaks the budget in strict mode, so CI fails on N+1 patterns
+    pass
+
+
+# metrics of the request handled by the current task, None outside of requests
+current_request: ContextVar[RequestMetrics | None] = ContextVar('current_request', default=None)
+
+
+class MetricsMiddleware:
+    # plain ASGI middleware, BaseHTTPMiddleware would cost a task per request
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        request_metrics = RequestMetrics()
+        token = current_request.set(request_metrics)
+        status_code: int = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+                if DATABASE_DEBUG_HEADERS:
+                    message['headers'] = list(message.get('headers', [])) + [
+                        (b'x-db-queries', str(request_metrics.db_queries).encode()),
+                        (b'x-db-rows', str(request_metrics.db_rows).encode()),
+                        (b'x-db-time', f'{request_metrics.db_duration * 1000:.1f}'.encode()),  # milliseconds
+                        (b'x-db-repeats', str(request_metrics.most_repeated()[1]).encode()),
+                        (b'x-redis-round-trips', str(request_metrics.redis_round_trips).encode()),
+                    ]
+            await send(message)
+
+        start: float = perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration: float = perf_counter() - start
+            current_request.reset(token)
+            # route templates instead of paths, so level ids do not become labels
+            route = scope.get('route')
+            path: str = route.path if route is not None else 'other'
+            http_requests.inc(path, scope['method'], status_code)
+            http_request_duration.observe(duration, path, scope['method'])
+            http_request_db_queries.observe(request_metrics.db_queries, path)
+            http_request_db_duration.observe(request_metrics.db_duration, path)
+            http_request_redis_round_trips.observe(request_metrics.redis_round_trips, path)
+            report_query_budget(request_metrics, scope['method'], path)
+
+
+def report_query_budget(request_metrics: RequestMetrics, method: str, path: str):
+    if DATABASE_QUERY_BUDGET and request_metrics.db_queries > DATABASE_QUERY_BUDGET:
+        query_budget_exceeded.inc(path, 'queries')
+        logger.warning(f'{method} {path} ran {request_metrics.db_queries} queries, '
+                       f'the budget is {DATABASE_QUERY_BUDGET}')
+    statement, runs = request_metrics.most_repeated()
+    if DATABASE_REPEAT_LIMIT and runs >= DATABASE_REPEAT_LIMIT:
+        query_budget_exceeded.inc(path, 'repeats')
+        logger.warning(f'{method} {path} ran one statement {runs} times (N+1?): {" ".join(statement.split())[:300]}')
+
+
+def instrument_engine(engine: AsyncEngine):
+    @event.listens_for(engine.sync_engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context.metrics_start = perf_counter()
+
+    @event.listens_for(engine.sync_engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        duration: float = perf_counter() - context.metrics_start
+        db_query_duration.observe(duration)
+        if (request_metrics := current_request.get()) is None:
+            return
+        request_metrics.db_queries += 1
+        request_metrics.db_duration += duration
+        if context.isinsert or context.isupdate or context.isdelete:
+            # rowcount of a SELECT is -1 or 0 on SQLite and asyncpg, only changed rows are reported everywhere
+            request_metrics.db_rows += max(cursor.rowcount, 0)
+        runs: int = 0
+        if DATABASE_REPEAT_LIMIT:
+            # bound parameters are not part of the statement, so a query in a loop repeats it exactly
+            runs = request_metrics.statements[statement] = request_metrics.statements.get(statement, 0) + 1
+        if not DATABASE_STRICT_QUERY_BUDGET:
+            return
+        if DATABASE_QUERY_BUDGET and request_metrics.db_queries > DATABASE_QUERY_BUDGET:
+            raise QueryBudgetExceeded(f'{request_metrics.db_queries} queries, the budget is {DATABASE_QUERY_BUDGET}')
+        if DATABASE_REPEAT_LIMIT and runs >= DATABASE_REPEAT_LIMIT:
+            raise QueryBudgetExceeded(f'statement ran {runs} times (N+1?): {" ".join(statement.split())[:300]}')
+
+
+class InstrumentedRedisConnection(RedisConnection):
+    # a command or a whole pipeline is sent at once, one round trip
+    async def send_packed_command(self, command, check_health: bool = True):
+        redis_round_trips.inc()
+        if (request_metrics := current_request.get()) is not None:
+            request_metrics.redis_round_trips += 1
+        await super().send_packed_command(command, check_health)
+
+
+def instrument_storage(storage):
+    # time the provider's remote calls, wrapped on the instance so every provider is covered
+    for operation in ('upload_file', 'delete_level', 'dump_level_data'):
+        method = getattr(storage, operation, None)
+        if method is None:
+            continue
+
+        async def timed(*args, _method=method, _operation=operation, **kwargs):
+            start: float = perf_counter()
+            try:
+                return await _method(*args, **kwargs)
+            finally:
+                storage_duration.observe(perf_counter() - start, storage.type, _operation)
+
+        setattr(storage, operation, timed)
+    return storage
+
+
+async def event_loop_lag_loop(interval: float = 1):
+    loop = asyncio.get_running_loop()
+    while True:
+        start: float = loop.time()
+        await asyncio.sleep(interval)
+        event_loop_lag.observe(max(0.0, loop.time() - start - interval))
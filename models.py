@@ -100,6 +100,9 @@ class LevelDetailsUserData(PydanticModel):
     liked: str
 
 
+# Wire format of level results, documented in the OpenAPI schema.
+# common.level_to_fragment and the *_response encoders write it without these models,
+# tests/test_level_rendering.py keeps them in sync.
 class LevelDetails(PydanticModel):
     name: str
     likes: int
@@ -127,6 +130,7 @@ class DetailedSearchResults(PydanticModel):
     rows_perpage: int
     pages: int
     result: list[LevelDetails]
+    next_cursor: Optional[str] = None  # Opaque keyset pagination cursor of the next page
 
 
 class SingleLevelDetails(PydanticModel):
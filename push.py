@@ -1,51 +1,186 @@
-from asyncio.queues import Queue as AsyncQueue
+from random import random
+from time import monotonic
+import asyncio
 import aiohttp
-import discord
+from loguru import logger
+
+from database.outbox import push_outbox, OutboxEvent
 
 from config import (
+    ENABLE_DISCORD_WEBHOOK,
+    ENABLE_ENGINE_BOT_WEBHOOK,
+    ENABLE_ENGINE_BOT_COUNTER_WEBHOOK,
     ENGINE_BOT_WEBHOOK_URLS,
     DISCORD_WEBHOOK_URLS,
     DISCORD_AVATAR_URL,
-    DISCORD_NICKNAME
+    DISCORD_NICKNAME,
+    DISCORD_COALESCE_DELAY,
+    PUSH_TIMEOUT,
+    PUSH_RETRIES,
+    PUSH_CONCURRENCY
 )
 
-engine_bot_push_queue: AsyncQueue = AsyncQueue()
-discord_push_queue: AsyncQueue = AsyncQueue()
+DISCORD_MESSAGE_LIMIT: int = 2000  # Discord rejects longer message contents
+DISCORD_BATCH_SIZE: int = 50  # Pending Discord messages coalesced at once
 
 __all__ = [
     "push_to_engine_bot",
     "push_to_engine_bot_discord",
+    "push_counter_milestone",
 ]
 
+_discord_milestone_messages: dict[str, str] = {
+    "plays": "🎉 Felicidades, el **{level_name}** de **{author}** ha sido reproducido **{value}** veces!",
+    "clears": "🎉 Felicidades, el **{level_name}** de **{author}** ha salido victorioso **{value}** veces!",
+    "likes": "🎉 Felicidades, el **{level_name}** de **{author}** tiene **{value}** me gusta!",
+    # No discord push of deaths xd
+}
+
 
-async def push_to_engine_bot(data: dict):
+async def push_to_engine_bot(data: dict, merge_key: str | None = None):
     # This function is used to push messages to general Engine Bots
     # (Not limited to QQ)
     # You can construct your own Engine Bot with this API for other IMs
-    await engine_bot_push_queue.put(data)
+    await push_outbox.add(ENGINE_BOT_WEBHOOK_URLS, data, merge_key=merge_key)
+
+
+async def push_to_engine_bot_discord(message: str, merge_key: str | None = None):
+    await push_outbox.add(DISCORD_WEBHOOK_URLS, message, merge_key=merge_key)
+
+
+async def push_counter_milestone(counter: str, value: int, level_id: str, level_name: str, author_name: str):
+    # 100 / 1000 plays, deaths, clears or likes
+    merge_key: str = f"{value}_{counter}:{level_id}"
+    if ENABLE_DISCORD_WEBHOOK and counter in _discord_milestone_messages:
+        await push_to_engine_bot_discord(
+            _discord_milestone_messages[counter].format(level_name=level_name, author=author_name, value=value)
+            + f"\n> ID: `{level_id}`",
+            merge_key=merge_key
+        )
+    if ENABLE_ENGINE_BOT_WEBHOOK and ENABLE_ENGINE_BOT_COUNTER_WEBHOOK:
+        await push_to_engine_bot({
+            "type": f"{value}_{counter}",
+            "level_id": level_id,
+            "level_name": level_name,
+            "author": author_name,
+        }, merge_key=merge_key)
+
+
+class WebhookTarget:
+    # One webhook URL with its own pooled connections, concurrency limit, timeout and retries
+    def __init__(self, url: str):
+        self.url = url
+        self._session: aiohttp.ClientSession | None = None
+        self._slots = asyncio.Semaphore(PUSH_CONCURRENCY)
+        self._blocked_until: float = 0  # monotonic time until which the target asked us to wait
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=PUSH_TIMEOUT),
+                connector=aiohttp.TCPConnector(limit=PUSH_CONCURRENCY)
+            )
+        return self._session
+
+    async def post(self, data: dict) -> bool:
+        # returns whether the webhook accepted the data
+        async with self._slots:
+            for attempt in range(PUSH_RETRIES + 1):
+                if (wait := self._blocked_until - monotonic()) > 0:
+                    await asyncio.sleep(wait)
+                try:
+                    async with self._get_session().post(self.url, json=data) as response:
+                        self._respect_rate_limit(response)
+                        if response.status < 400:
+                            return True
+                        if response.status != 429 and response.status < 500:
+                            logger.error(f'Webhook {self.url} rejected push: {response.status}')
+                            return False
+                        logger.warning(f'Webhook {self.url} failed: {response.status}')
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    logger.warning(f'Webhook {self.url} failed: {e!r}')
+                if attempt < PUSH_RETRIES:
+                    await asyncio.sleep(min(2 ** attempt, 60) * (0.5 + random()))
+            logger.error(f'Gave up pushing to {self.url} after {PUSH_RETRIES + 1} attempts')
+            return False
 
+    def _respect_rate_limit(self, response: aiohttp.ClientResponse):
+        # Retry-After on 429, Discord also announces exhausted buckets before we hit them
+        if response.status == 429 and 'Retry-After' in response.headers:
+            delay = float(response.headers['Retry-After'])
+        elif response.headers.get('X-RateLimit-Remaining') == '0' and 'X-RateLimit-Reset-After' in response.headers:
+            delay = float(response.headers['X-RateLimit-Reset-After'])
+        else:
+            return
+        self._blocked_until = max(self._blocked_until, monotonic() + delay)
 
-async def push_to_engine_bot_discord(message: str):
-    await discord_push_queue.put(message)
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
 
 
-async def push_to_engine_bot_sub():
+_engine_bot_targets: list[WebhookTarget] = [WebhookTarget(url) for url in ENGINE_BOT_WEBHOOK_URLS]
+_discord_targets: list[WebhookTarget] = [WebhookTarget(url) for url in DISCORD_WEBHOOK_URLS]
+
+
+async def push_to_engine_bot_sub(target: WebhookTarget):
+    # every target delivers its own outbox, a slow one only delays itself
     while True:
-        data = await engine_bot_push_queue.get()
-        for webhook_url in ENGINE_BOT_WEBHOOK_URLS:
-            async with aiohttp.request(
-                    method="POST",
-                    url=webhook_url,
-                    json=data
-            ) as response:
-                pass
+        await push_outbox.wait(target.url)
+        try:
+            while events := await push_outbox.fetch(target.url, PUSH_CONCURRENCY):
+                await asyncio.gather(*[target.post(event.payload) for event in events])
+                await push_outbox.remove(target.url, events)
+        except Exception as e:
+            logger.error(f'Failed to push to Engine Bot: {e!r}')
+            await asyncio.sleep(5)
+            push_outbox.wake(target.url)
 
 
-async def push_to_engine_bot_discord_sub():
+async def push_to_engine_bot_discord_sub(target: WebhookTarget):
+    # bursts of messages are joined into as few webhook calls as Discord's message length allows
     while True:
-        message = await discord_push_queue.get()
-        async with aiohttp.ClientSession() as session:
-            for webhook_url in DISCORD_WEBHOOK_URLS:
-                webhook = discord.Webhook.from_url(url=webhook_url, session=session)
-                message: str = str(message)
-                await webhook.send(str(message), username=DISCORD_NICKNAME, avatar_url=DISCORD_AVATAR_URL)
+        await push_outbox.wait(target.url)
+        await asyncio.sleep(DISCORD_COALESCE_DELAY)
+        try:
+            while events := await push_outbox.fetch(target.url, DISCORD_BATCH_SIZE):
+                for n, content in enumerate(_coalesce_discord_messages(events)):
+                    if n:
+                        # the claim covers one message with its retries, the batch may take longer
+                        await push_outbox.renew(events)
+                    await target.post({
+                        'content': content,
+                        'username': DISCORD_NICKNAME,
+                        'avatar_url': DISCORD_AVATAR_URL
+                    })
+                await push_outbox.remove(target.url, events)
+        except Exception as e:
+            logger.error(f'Failed to push to Discord: {e!r}')
+            await asyncio.sleep(5)
+            push_outbox.wake(target.url)
+
+
+def _coalesce_discord_messages(events: list[OutboxEvent]) -> list[str]:
+    contents: list[str] = []
+    for event in events:
+        message: str = str(event.payload)[:DISCORD_MESSAGE_LIMIT]
+        if contents and len(contents[-1]) + 2 + len(message) <= DISCORD_MESSAGE_LIMIT:
+            contents[-1] += '\n\n' + message
+        else:
+            contents.append(message)
+    return contents
+
+
+def start_push_subs() -> list[asyncio.Task]:
+    return [asyncio.create_task(push_to_engine_bot_sub(target)) for target in _engine_bot_targets] + [
+        asyncio.create_task(push_to_engine_bot_discord_sub(target)) for target in _discord_targets
+    ]
+
+
+async def load_push_outbox(db):
+    await push_outbox.load(db, ENGINE_BOT_WEBHOOK_URLS + DISCORD_WEBHOOK_URLS)
+
+
+async def close_push_sessions():
+    for target in _engine_bot_targets + _discord_targets:
+        await target.close()
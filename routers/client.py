@@ -14,11 +14,10 @@ from common import (
 )
 from database.db_access import DBAccessLayer
 from database.models import Client
-from depends import create_dal, connection_count_inc
+from depends import create_dal
 
 router = APIRouter(
-    prefix="/client",
-    dependencies=[Depends(connection_count_inc)]
+    prefix="/client"
 )
 
 
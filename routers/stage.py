@@ -1,12 +1,13 @@
 import datetime
+import os
 import re
 from math import ceil
 
 from fastapi import Form, Depends, Request
 from routers.api_router import APIRouter
-from fastapi.responses import RedirectResponse, Response
+from fastapi.responses import RedirectResponse, Response, FileResponse
 from typing import Optional
-from sqlalchemy import select, func, and_, or_
+from sqlalchemy import select, and_, or_
 import aiohttp
 from loguru import logger
 
@@ -19,29 +20,30 @@ from config import (
     BOOSTERS_EXTRA_LIMIT,
     UPLOAD_LIMIT,
     ROWS_PERPAGE,
-    RECORD_CLEAR_USERS
+    RECORD_CLEAR_USERS,
+    SEARCH_PAGE_CURSOR_CACHE_SIZE,
+    SEARCH_PAGE_CURSOR_TTL
 )
 from depends import (
     is_valid_user,
     create_dal,
-    verify_and_get_session,
-    connection_count_inc
+    verify_and_get_session
 )
 from locales import parse_tag_names  # for fallback messages
 from models import (
     ErrorMessage,
     StageSuccessMessage,
-    LevelDetails,
-    SingleLevelDetails,
+    UserErrorMessage,
     DetailedSearchResults,
-    UserErrorMessage
+    SingleLevelDetails
 )
+from level_file import PreparedLevel
 from common import (
-    strip_level,
-    gen_level_id_md5,
-    gen_level_id_sha1,
-    gen_level_id_sha256,
-    level_to_details,
+    string_latinify,
+    level_to_fragment,
+    detailed_search_response,
+    single_level_response,
+    LevelFragment,
     ClientType,
     get_locale_model
 )
@@ -51,42 +53,43 @@ from push import (
 )
 from database.db_access import DBAccessLayer
 from database.models import *
+from database.difficulty import DIFFICULTIES
+from database.search import level_search
+from database.pagination import (
+    LevelOrdering,
+    PageCursorCache,
+    order_levels,
+    seek_levels,
+    level_sort_key,
+    encode_cursor,
+    decode_cursor
+)
 from session.models import Session
+from ingest import level_ingest, IngestQueueFull
+import leaderboard
+import search_cache
 
 router = APIRouter(
     prefix="/stage",
     dependencies=[
-        Depends(is_valid_user),
-        Depends(connection_count_inc)
+        Depends(is_valid_user)
     ],
 )
 
-
-async def get_author_name_by_level(level: Level, dal: DBAccessLayer) -> str:
-    author_user = await dal.get_user_by_id(level.author_id)
-    if author_user is None:
-        return "Unknown"
-    else:
-        return author_user.username
+page_cursors = PageCursorCache(max_size=SEARCH_PAGE_CURSOR_CACHE_SIZE, ttl=SEARCH_PAGE_CURSOR_TTL)
 
 
-async def get_record_user_name_by_level(level: Level, dal: DBAccessLayer) -> str:
-    if level.record_user_id == 0:
-        return "None"
-    else:
-        record_user = await dal.get_user_by_id(level.record_user_id)
-        if record_user is None:
-            return "Unknown"
-        else:
-            return record_user.username
+async def get_author_name_by_level(level: Level, dal: DBAccessLayer) -> str:
+    return (await dal.get_usernames_by_ids({level.author_id})).get(level.author_id, "Unknown")
 
 
 # router.post("s/detailed_search") == stages/detailed_search
-@router.post("s/detailed_search")
+@router.post("s/detailed_search", response_model=DetailedSearchResults | ErrorMessage)
 async def stages_detailed_search_handler(
         request: Request,
         featured: Optional[str] = Form(None),
         page: Optional[str] = Form("1"),
+        cursor: Optional[str] = Form(None),
         title: Optional[str] = Form(None),
         author: Optional[str] = Form(None),
         aparience: Optional[str] = Form(None),
@@ -107,30 +110,31 @@ async def stages_detailed_search_handler(
     client_type = ClientType(session.client_type)
     locale_model = get_locale_model(session.locale)
 
-    results: list[LevelDetails] = []
-
     # Filter and search
     selection = select(Level)
+    ordering: LevelOrdering = LevelOrdering.LATEST  # latest levels
+    filters: dict = {}  # normalized filters, identifies the query across requests
+    relevance = None  # title search relevance
 
     if featured:
         match featured:
             case "promising":
                 # featured levels
-                selection = selection.where(Level.featured == True).order_by(Level.id.desc())
+                selection = selection.where(Level.featured == True)
             case "popular":
                 # popular levels
-                selection = selection.order_by((Level.likes - Level.dislikes).desc())
+                ordering = LevelOrdering.POPULAR
             case "notpromising":
                 # not featured levels (post-3.3.0)
                 selection = selection.where(Level.featured == False)
             case _:
                 return ErrorMessage(error_type="031", message=locale_model.UNKNOWN_QUERY_MODE)
-    else:
-        selection = selection.order_by(Level.id.desc())  # latest levels
+        filters["featured"] = featured
 
     # avoid non-testing client error
     if client_type is not ClientType.TESTING:
         selection = selection.where(Level.testing_client == False)
+        filters["testing_client"] = False
 
     # convert page to int
     if not page:
@@ -141,18 +145,21 @@ async def stages_detailed_search_handler(
     # detailed search
     if title:
         title = title.encode("latin1").decode("utf-8")
-        selection = selection.where(Level.name.contains(title))
+        selection, relevance = level_search.apply(selection, title)
+        filters["title"] = title
     if author:
-        _author = await dal.get_user_by_username(author)
-        if _author is not None:
-            author_id: int = _author.id
+        author_id: int | None = await dal.get_user_id_by_username(author)
+        if author_id is not None:
             selection = selection.where(Level.author_id == author_id)
+            filters["author_id"] = author_id
         else:
             return ErrorMessage(error_type="006", message=locale_model.ACCOUNT_NOT_FOUND)
     if aparience:
         selection = selection.where(Level.style == int(aparience))
+        filters["style"] = int(aparience)
     if entorno:
         selection = selection.where(Level.environment == int(entorno))
+        filters["environment"] = int(entorno)
     if last:
         days: int = int(last.strip("d"))
         selection = selection.where(
@@ -161,10 +168,13 @@ async def stages_detailed_search_handler(
                 datetime.date.today(),
             )
         )
+        filters["last"] = days
     if sort:
         match sort:
             case "antiguos":
-                selection = selection.order_by(Level.id.asc())
+                # popular lists keep their ranking, as before
+                if ordering is not LevelOrdering.POPULAR:
+                    ordering = LevelOrdering.OLDEST
             case "popular":
                 # post-3.3.0
                 selection = selection.where(
@@ -173,7 +183,8 @@ async def stages_detailed_search_handler(
                         datetime.date.today(),
                     )
                 )
-                selection = selection.order_by((Level.likes - Level.dislikes).desc())
+                ordering = LevelOrdering.POPULAR
+                filters["popular_days"] = 7
             case _:
                 return ErrorMessage(error_type="031", message=locale_model.UNKNOWN_QUERY_MODE)
     if liked:
@@ -182,25 +193,19 @@ async def stages_detailed_search_handler(
             if liked_data.parent_id not in level_data_ids:
                 level_data_ids.append(liked_data.parent_id)
         selection = selection.where(Level.id.in_(level_data_ids))
+        filters["liked_by"] = session.user_id
     elif disliked:
         level_data_ids: list[int] = []  # Disliked levels' data ids
         for disliked_data in await dal.get_disliked_levels_by_user(session.user_id):
             if disliked_data.parent_id not in level_data_ids:
                 level_data_ids.append(disliked_data.parent_id)
         selection = selection.where(Level.id.in_(level_data_ids))
+        filters["disliked_by"] = session.user_id
     if dificultad:
-        selection = selection.where(Level.plays != 0)
-        match dificultad:
-            case "0":
-                selection = selection.where((Level.clears / Level.plays).between(0.2, 10.0))  # Easy
-            case "1":
-                selection = selection.where((Level.clears / Level.plays).between(0.08, 0.2))  # Normal
-            case "2":
-                selection = selection.where((Level.clears / Level.plays).between(0.01, 0.08))  # Hard
-            case "3":
-                selection = selection.where((Level.clears / Level.plays).between(0.0, 0.01))  # Expert
-            case _:
-                return ErrorMessage(error_type="030", message=locale_model.UNKNOWN_DIFFICULTY)
+        if not dificultad.isdigit() or int(dificultad) not in DIFFICULTIES:
+            return ErrorMessage(error_type="030", message=locale_model.UNKNOWN_DIFFICULTY)
+        selection = selection.where(Level.difficulty == int(dificultad))  # 0 easy - 3 expert
+        filters["difficulty"] = int(dificultad)
     if tags:
         tags = tags.encode("latin1").decode("utf-8")
         tag_1, tag_2 = parse_tag_names(tags, session.locale)
@@ -211,6 +216,7 @@ async def stages_detailed_search_handler(
                 and_(Level.tag_1 == tag_1, Level.tag_2 == tag_2),
                 and_(Level.tag_1 == tag_2, Level.tag_2 == tag_1)
             ))
+        filters["tags"] = (tag_1, tag_2)
 
     if historial:
         if not RECORD_CLEAR_USERS:
@@ -225,17 +231,87 @@ async def stages_detailed_search_handler(
                     selection = selection.where(Level.id.in_(level_data_ids_cleared))
                 if historial == "1":  # not cleared
                     selection = selection.where(Level.id.not_in(level_data_ids_cleared))
+                filters["historial"] = (historial, session.user_id)
             else:
                 return ErrorMessage(error_type="031", message=locale_model.UNKNOWN_QUERY_MODE)
 
-    # get numbers
-    num_rows: int = await dal.get_level_count(selection)
+    query_key: tuple = (ordering.value, *sorted(filters.items()))
+    # searches bound to the user's likes or clears are not shared
+    shared: bool = not any(key in filters for key in ("liked_by", "disliked_by", "historial"))
 
-    # pagination
-    selection = selection.offset((page - 1) * ROWS_PERPAGE).limit(ROWS_PERPAGE)
+    # identical shared pages are served from Redis, only the user's likes and clears are resolved per request
+    if shared:
+        page_cache_key: tuple = (
+            query_key, page, cursor, rows_perpage, session.locale, session.mobile, client_type.value
+        )
+        cache_generation, cached_page = await search_cache.get_page(request.app.state.redis, page_cache_key)
+        if cached_page is not None:
+            marks = await dal.get_level_marks(set(cached_page["level_pks"]), session.user_id)
+            await dal.commit()
+            if cached_page["next_cursor"] and not cursor:
+                page_cursors.set(query_key, page + 1, cached_page["next_cursor"])
+            return detailed_search_response(
+                num_rows=cached_page["num_rows"],
+                rows_perpage=cached_page["rows_perpage"],
+                pages=cached_page["pages"],
+                rows=[
+                    LevelFragment(head=head.encode(), tail=tail.encode()).render(
+                        completed=marks.clear_type(level_pk),
+                        liked=marks.like_type(level_pk)
+                    ) for level_pk, (head, tail) in zip(cached_page["level_pks"], cached_page["result"])
+                ],
+                next_cursor=cached_page["next_cursor"]
+            )
+
+    if (
+            ordering is LevelOrdering.POPULAR and not cursor
+            and set(filters) <= {"featured", "testing_client", "popular_days"}
+            and filters.get("featured", "popular") == "popular"
+    ):
+        # plain popular lists are ranked by the Redis leaderboard, the database only hydrates the page
+        level_pks, num_rows = await leaderboard.get_popular_level_page(
+            request.app.state.redis,
+            recent="popular_days" in filters,
+            testing_client=client_type is ClientType.TESTING,
+            offset=(page - 1) * ROWS_PERPAGE,
+            count=ROWS_PERPAGE
+        )
+        levels = await dal.get_levels_by_ids(level_pks)
+        next_cursor: str | None = None
+    else:
+        # get numbers
+        num_rows: int = await dal.count_levels(
+            selection,
+            count_key=tuple(sorted(filters.items())) if shared else None,
+            estimate=any(key in filters for key in ("title", "tags"))
+        )
 
-    # do query
-    levels = await dal.execute_selection(selection)
+        # pagination
+        # an explicit cursor wins, otherwise translate the page number to a cursor if we know where it starts
+        seek_key: list[int] | None = None
+        # title searches without an explicit order are ranked by relevance, which has no keyset
+        ranked: bool = relevance is not None and ordering is LevelOrdering.LATEST
+        if ranked:
+            selection = selection.order_by(relevance.desc())
+        elif cursor:
+            seek_key = decode_cursor(cursor, ordering)
+        elif page > 1:
+            if (page_cursor := page_cursors.get(query_key, page)) is not None:
+                seek_key = decode_cursor(page_cursor, ordering)
+        selection = order_levels(selection, ordering)
+        if seek_key is not None:
+            selection = seek_levels(selection, ordering, seek_key).limit(ROWS_PERPAGE)
+        else:
+            selection = selection.offset((page - 1) * ROWS_PERPAGE).limit(ROWS_PERPAGE)
+
+        # do query
+        levels = await dal.execute_selection(selection)
+
+        next_cursor: str | None = None
+        if len(levels) == ROWS_PERPAGE and not ranked:
+            next_cursor = encode_cursor(ordering, level_sort_key(levels[-1], ordering))
+            if not cursor:
+                page_cursors.set(query_key, page + 1, next_cursor)
 
     if num_rows > ROWS_PERPAGE:
         rows_perpage: int = int(rows_perpage) if rows_perpage is not None else ROWS_PERPAGE
@@ -245,41 +321,54 @@ async def stages_detailed_search_handler(
         pages = 1
 
     # get results
+    hydration = await dal.hydrate_levels(levels, session.user_id)
+    fragments: list[LevelFragment] = []
+    result_pks: list[int] = []
     for level in levels:
         try:
-            author_name: str = await get_author_name_by_level(level, dal)
-            record_user_name: str = await get_record_user_name_by_level(level, dal)
             level_file_url: str = storage.generate_url(level.level_id)
-            results.append(
-                level_to_details(
+            fragments.append(
+                level_to_fragment(
                     level_data=level,
                     locale=session.locale,
                     level_file_url=level_file_url,
                     mobile=session.mobile,
-                    like_type=await dal.get_like_type(level, session.user_id),
-                    clear_type=await dal.get_clear_type(level, session.user_id),
-                    author=author_name,
-                    record_user=record_user_name
+                    hydration=hydration
                 )
             )
+            result_pks.append(level.id)
         except Exception as e:
             logger.error(e)
     await dal.commit()
-    if len(results) == 0:
+    if len(fragments) == 0:
         return ErrorMessage(
             error_type="029", message=locale_model.LEVEL_NOT_FOUND
         )  # No level found
     else:
-        return DetailedSearchResults(
+        if shared:
+            await search_cache.set_page(request.app.state.redis, page_cache_key, cache_generation, {
+                "num_rows": num_rows,
+                "rows_perpage": rows_perpage,
+                "pages": pages,
+                "next_cursor": next_cursor,
+                "level_pks": result_pks,
+                "result": [[fragment.head.decode(), fragment.tail.decode()] for fragment in fragments]
+            })
+        return detailed_search_response(
             num_rows=num_rows,
             rows_perpage=rows_perpage,
             pages=pages,
-            result=results
+            rows=[
+                fragment.render(completed=hydration.clear_type(level_pk), liked=hydration.like_type(level_pk))
+                for level_pk, fragment in zip(result_pks, fragments)
+            ],
+            next_cursor=next_cursor
         )
 
 
 @router.post("/{level_id}/stats/likes")
 async def stats_likes_handler(
+        request: Request,
         level_id: str,
         dal: DBAccessLayer = Depends(create_dal),
         auth_code: str = Form(),
@@ -290,30 +379,17 @@ async def stats_likes_handler(
     if level is not None:
         await dal.add_like_to_level(user_id=session.user_id, level=level)
         await dal.commit()
+        await leaderboard.change_score(request.app.state.redis, level_pk=level.id, amount=1)
     else:
         return ErrorMessage(
             error_type="029", message=locale_model.LEVEL_NOT_FOUND
         )  # No level found
-    if level.likes == 100 or level.likes == 1000:
-        if ENABLE_DISCORD_WEBHOOK or (ENABLE_ENGINE_BOT_WEBHOOK and ENABLE_ENGINE_BOT_COUNTER_WEBHOOK):
-            author_name: str = await get_author_name_by_level(level, dal)
-            if ENABLE_DISCORD_WEBHOOK:
-                await push_to_engine_bot_discord(
-                    f"🎉 Felicidades, el **{level.name}** de **{author_name}** tiene **{level.likes}** me gusta!\n"
-                    f"> ID: `{level_id}`"
-                )
-            if ENABLE_ENGINE_BOT_WEBHOOK and ENABLE_ENGINE_BOT_COUNTER_WEBHOOK:
-                await push_to_engine_bot({
-                    "type": f"{level.likes}_likes",
-                    "level_id": level_id,
-                    "level_name": level.name,
-                    "author": author_name,
-                })
     return StageSuccessMessage(success="Successfully updated likes", type="stats", id=level_id)
 
 
 @router.post("/{level_id}/stats/dislikes", dependencies=[Depends(is_valid_user)])
 async def stats_dislikes_handler(
+        request: Request,
         level_id: str,
         dal: DBAccessLayer = Depends(create_dal),
         session: Session = Depends(verify_and_get_session)
@@ -323,6 +399,7 @@ async def stats_dislikes_handler(
     if level is not None:
         await dal.add_dislike_to_level(user_id=session.user_id, level=level)
         await dal.commit()
+        await leaderboard.change_score(request.app.state.redis, level_pk=level.id, amount=-1)
         return StageSuccessMessage(success="Successfully updated dislikes", type="stats", id=level_id)
     else:
         return ErrorMessage(
@@ -377,26 +454,35 @@ async def stages_upload_handler(
     if re.sub("[^\x00-\x7F\x80-\xFF\u0100-\u017F\u0180-\u024F\u1E00-\u1EFF]", "", name) != name:
         non_latin: bool = True
 
-    if len(swe.encode()) > 4 * 1024 * 1024:  # 4MB limit
+    # the limit applies to the .swe as uploaded (base64 level data and checksum, ASCII),
+    # checked before it is encoded, decoded or sent to a worker
+    if len(swe) > 4 * 1024 * 1024:  # 4MB limit
         return ErrorMessage(
             error_type="026", message=locale_model.FILE_TOO_LARGE
         )  # File too large
 
-    # strip level
-    stripped_swe: str = strip_level(swe)
+    # decode once, strip and hash the level in a worker process
+    try:
+        level_file: PreparedLevel = await level_ingest.prepare_level(swe)
+    except IngestQueueFull:
+        logger.warning(f"Upload queue is full, rejected level {name}")
+        return ErrorMessage(
+            error_type="038", message=locale_model.UPLOAD_QUEUE_FULL
+        )  # Server busy, try again later
 
     # generate level id and check if duplicate
-    level_id: str = gen_level_id_md5(stripped_swe)
+    level_id_md5, level_id_sha1, level_id_sha256 = level_file.level_ids
+    level_id: str = level_id_md5
     if await dal.get_level_by_level_id(level_id) is None:
         logger.info("md5: not duplicated")
     else:
         logger.info("md5: duplicated, fallback to sha1")
-        level_id = gen_level_id_sha1(stripped_swe)
+        level_id = level_id_sha1
         if await dal.get_level_by_level_id(level_id) is None:
             logger.info("sha1: not duplicated")
         else:
             logger.info("sha1: duplicated, fallback to sha256")
-            level_id = gen_level_id_sha256(stripped_swe)
+            level_id = level_id_sha256
             if await dal.get_level_by_level_id(level_id) is None:
                 logger.info("sha256: not duplicated")
             else:
@@ -413,15 +499,15 @@ async def stages_upload_handler(
 
     try:
         await storage.upload_file(
-            level_data=swe, level_id=level_id
+            level_file=level_file, level_id=level_id
         )  # Upload to storage provider
-    except ConnectionError:
+    except OSError:  # ConnectionError of remote providers or a filesystem error
         return ErrorMessage(
             error_type="010", message=locale_model.UPLOAD_CONNECT_ERROR
         )
 
     tag_1, tag_2 = parse_tag_names(tags, session.locale)
-    await dal.add_level(
+    level: Level = await dal.add_level(
         name=name,
         style=int(aparience),
         environment=int(entorno),
@@ -430,9 +516,16 @@ async def stages_upload_handler(
         author_id=session.user_id,
         level_id=level_id,
         non_latin=non_latin,
+        name_latin=(string_latinify(name) if non_latin else None),
         testing_client=(True if client_type is ClientType.TESTING else False),
         description=desc
     )  # add new level to database
+    await dal.commit()
+    await leaderboard.add_level(
+        request.app.state.redis, level_pk=level.id, testing_client=level.testing_client, date=level.date
+    )
+    await search_cache.invalidate(request.app.state.redis)
+    # queued once the level is committed, a rolled back upload is never announced
     if ENABLE_DISCORD_WEBHOOK and ENABLE_DISCORD_ARRIVAL_WEBHOOK:
         await push_to_engine_bot_discord(
             f'📤 **{user.username}** subió un nuevo nivel: **{name}**\n'
@@ -447,11 +540,10 @@ async def stages_upload_handler(
             "level_name": name,
             "author": user.username,
         })
-    await dal.commit()
     return StageSuccessMessage(success="Successfully uploaded level", type="upload", id=level_id)
 
 
-@router.post("/random")
+@router.post("/random", response_model=SingleLevelDetails | ErrorMessage)
 async def stage_id_random_handler(
         request: Request,
         dificultad: Optional[str] = Form(None),
@@ -462,40 +554,31 @@ async def stage_id_random_handler(
     storage = request.app.state.storage
     locale_model = get_locale_model(session.locale)
     user_id: int = session.user_id
-    selection = select(Level).order_by(func.random()).limit(1)
+    difficulty: int | None = None  # any difficulty
     if dificultad:
-        selection = selection.where(Level.plays != 0)
-        match dificultad:
-            case "0":
-                selection = selection.where((Level.clears / Level.plays).between(0.2, 10.0))  # Easy
-            case "1":
-                selection = selection.where((Level.clears / Level.plays).between(0.08, 0.2))  # Normal
-            case "2":
-                selection = selection.where((Level.clears / Level.plays).between(0.01, 0.08))  # Hard
-            case "3":
-                selection = selection.where((Level.clears / Level.plays).between(0.0, 0.01))  # Expert
-            case _:
-                return ErrorMessage(error_type="030", message=locale_model.UNKNOWN_DIFFICULTY)
-    level: Level = (await dal.execute_selection(selection))[0]
-    author_name: str = await get_author_name_by_level(level, dal)
-    record_user_name: str = await get_record_user_name_by_level(level, dal)
+        if not dificultad.isdigit() or int(dificultad) not in DIFFICULTIES:
+            return ErrorMessage(error_type="030", message=locale_model.UNKNOWN_DIFFICULTY)
+        difficulty = int(dificultad)  # 0 easy - 3 expert
+    level: Level | None = await dal.get_random_level(difficulty)
+    if level is None:
+        return ErrorMessage(
+            error_type="029", message=locale_model.LEVEL_NOT_FOUND
+        )  # No level found
     level_file_url: str = storage.generate_url(level.level_id)
-    return SingleLevelDetails(
-        type="random",
-        result=level_to_details(
+    hydration = await dal.hydrate_levels([level], user_id)
+    return single_level_response(
+        search_type="random",
+        row=level_to_fragment(
             level_data=level,
             locale=session.locale,
             level_file_url=level_file_url,
             mobile=session.mobile,
-            like_type=await dal.get_like_type(level=level, user_id=user_id),
-            clear_type=await dal.get_clear_type(level=level, user_id=user_id),
-            author=author_name,
-            record_user=record_user_name
-        )
+            hydration=hydration
+        ).render(completed=hydration.clear_type(level.id), liked=hydration.like_type(level.id))
     )
 
 
-@router.post("/{level_id}")
+@router.post("/{level_id}", response_model=SingleLevelDetails | ErrorMessage)
 async def stage_id_search_handler(
         request: Request,
         level_id: str,
@@ -507,22 +590,18 @@ async def stage_id_search_handler(
     locale_model = get_locale_model(session.locale)
     user_id: int = session.user_id
     level: Level | None = await dal.get_level_by_level_id(level_id=level_id)
-    level_file_url: str = storage.generate_url(level.level_id)
     if level is not None:
-        author_name: str = await get_author_name_by_level(level, dal)
-        record_user_name: str = await get_record_user_name_by_level(level, dal)
-        return SingleLevelDetails(
-            type="id",
-            result=level_to_details(
+        level_file_url: str = storage.generate_url(level.level_id)
+        hydration = await dal.hydrate_levels([level], user_id)
+        return single_level_response(
+            search_type="id",
+            row=level_to_fragment(
                 level_data=level,
                 locale=session.locale,
                 level_file_url=level_file_url,
                 mobile=session.mobile,
-                like_type=await dal.get_like_type(level=level, user_id=user_id),
-                clear_type=await dal.get_clear_type(level=level, user_id=user_id),
-                author=author_name,
-                record_user=record_user_name
-            )
+                hydration=hydration
+            ).render(completed=hydration.clear_type(level.id), liked=hydration.like_type(level.id))
         )
     else:
         return ErrorMessage(
@@ -543,9 +622,9 @@ async def stage_file_handler(
         case 'onemanager':
             return RedirectResponse(storage.generate_download_url(level_id=level_id))
         case 'database':
-            level_name: str = (await dal.get_level_by_level_id(level_id=level_id)).name
-            level_content = await storage.dump_level_data(level_id=level_id)
-            if level_content is None:
+            level_content: bytes | None = await storage.dump_level_data(level_id=level_id)
+            level_name: str | None = await dal.get_level_name(level_id=level_id) if level_content is not None else None
+            if level_name is None:
                 return ErrorMessage(
                     error_type="029", message="Level not found."
                 )  # No level found
@@ -557,6 +636,27 @@ async def stage_file_handler(
                 },
                 media_type='text/plain'
             )
+        case 'filesystem':
+            # served by the server straight from the file, with ETag and Range support;
+            # the name comes from the process cache, so the database is only asked once per level
+            level_path: str | None = storage.level_path(level_id)
+            if level_path is None or not os.path.isfile(level_path):
+                return ErrorMessage(
+                    error_type="029", message="Level not found."
+                )  # No level found
+            level_name: str | None = await dal.get_level_name(level_id=level_id)
+            if level_name is None:
+                return ErrorMessage(
+                    error_type="029", message="Level not found."
+                )  # No level found
+            return FileResponse(
+                path=level_path,
+                headers={
+                    'Content-Disposition': f'attachment; '
+                                           f'filename="{level_name}.swe"'
+                },
+                media_type='text/plain'
+            )
 
 
 @router.post("/{level_id}/delete")
@@ -588,7 +688,9 @@ async def stage_delete_handler(
     user.uploads -= 1
     await dal.update_user(user=user)
     await dal.commit()
-    if storage.type == 'database':
+    await leaderboard.remove_level(request.app.state.redis, level_pk=level.id)
+    await search_cache.invalidate(request.app.state.redis)
+    if storage.type in ['database', 'filesystem']:
         await storage.delete_level(level_id=level_id)
 
     return StageSuccessMessage(
@@ -598,6 +700,7 @@ async def stage_delete_handler(
 
 @router.post("/{level_id}/switch/promising")
 async def switch_promising_handler(
+        request: Request,
         level_id: str,
         auth_code: str = Form(),
         dal: DBAccessLayer = Depends(create_dal),
@@ -623,6 +726,7 @@ async def switch_promising_handler(
     if not level.featured:
         await dal.set_featured(level=level, is_featured=True)
         await dal.commit()
+        await search_cache.invalidate(request.app.state.redis)
         if ENABLE_DISCORD_WEBHOOK or (ENABLE_ENGINE_BOT_WEBHOOK and ENABLE_ENGINE_BOT_COUNTER_WEBHOOK):
             author_name: str = await get_author_name_by_level(level, dal)
             if ENABLE_DISCORD_WEBHOOK:
@@ -643,6 +747,7 @@ async def switch_promising_handler(
     else:
         await dal.set_featured(level=level, is_featured=False)
         await dal.commit()
+        await search_cache.invalidate(request.app.state.redis)
         return StageSuccessMessage(
             success="Successfully removed featured level", type="stage", id=level_id
         )
@@ -674,21 +779,6 @@ async def stats_intentos_handler(
         )  # No level found
     await dal.add_play_to_level(level=level)
     await dal.commit()
-    if level.plays == 100 or level.plays == 1000:
-        if ENABLE_DISCORD_WEBHOOK or (ENABLE_ENGINE_BOT_WEBHOOK and ENABLE_ENGINE_BOT_COUNTER_WEBHOOK):
-            author_name: str = await get_author_name_by_level(level, dal)
-            if ENABLE_DISCORD_WEBHOOK:
-                await push_to_engine_bot_discord(
-                    f"🎉 Felicidades, el **{level.name}** de **{author_name}** ha sido reproducido **{level.plays}** veces!\n"
-                    f"> ID: `{level_id}`"
-                )
-            if ENABLE_ENGINE_BOT_WEBHOOK and ENABLE_ENGINE_BOT_COUNTER_WEBHOOK:
-                await push_to_engine_bot({
-                    "type": f"{level.plays}_plays",
-                    "level_id": level_id,
-                    "level_name": level.name,
-                    "author": author_name,
-                })
     return StageSuccessMessage(
         success="Successfully updated plays", id=level_id, type="stats"
     )
@@ -712,21 +802,6 @@ async def stats_victorias_handler(
     if level.record == 0 or level.record > new_record:
         await dal.update_record_to_level(user_id=session.user_id, level=level, record=new_record)
     await dal.commit()
-    if level.clears == 100 or level.clears == 1000:
-        if ENABLE_DISCORD_WEBHOOK or (ENABLE_ENGINE_BOT_WEBHOOK and ENABLE_ENGINE_BOT_COUNTER_WEBHOOK):
-            author_name: str = await get_author_name_by_level(level, dal)
-            if ENABLE_DISCORD_WEBHOOK:
-                await push_to_engine_bot_discord(
-                    f"🎉 Felicidades, el **{level.name}** de **{author_name}** ha salido victorioso **{level.clears}** veces!\n"
-                    f"> ID: `{level_id}`"
-                )
-            if ENABLE_ENGINE_BOT_WEBHOOK and ENABLE_ENGINE_BOT_COUNTER_WEBHOOK:
-                await push_to_engine_bot({
-                    "type": f"{level.clears}_clears",
-                    "level_id": level_id,
-                    "level_name": level.name,
-                    "author": author_name,
-                })
     return StageSuccessMessage(
         success="Successfully updated clears", id=level_id, type="stats"
     )
@@ -746,16 +821,6 @@ async def stats_muertes_handler(
         )  # No level found
     await dal.add_death_to_level(level=level)
     await dal.commit()
-    if level.deaths == 100 or level.deaths == 1000:
-        if ENABLE_ENGINE_BOT_WEBHOOK and ENABLE_ENGINE_BOT_COUNTER_WEBHOOK:
-            author_name: str = await get_author_name_by_level(level, dal)
-            await push_to_engine_bot({
-                "type": f"{level.deaths}_deaths",
-                "level_id": level_id,
-                "level_name": level.name,
-                "author": author_name,
-            })
-            # No discord push of deaths xd
     return StageSuccessMessage(
         success="Successfully updated deaths", id=level_id, type="stats"
     )
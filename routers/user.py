@@ -29,19 +29,18 @@ from config import (
 )
 from database.db_access import DBAccessLayer
 from database.models import User, Client
+from database.user_directory import publish_invalidation
 from session.models import Session
 from session.session_access import (
     get_session_by_id,
     new_session
 )
 from depends import (
-    create_dal,
-    connection_count_inc
+    create_dal
 )
 
 router = APIRouter(
-    prefix="/user",
-    dependencies=[Depends(connection_count_inc)]
+    prefix="/user"
 )
 
 
@@ -197,6 +196,7 @@ async def user_register_handler(
 
 @router.post("/{user_identifier}/permission/{permission}")  # Update permission
 async def user_set_permission_handler(
+        request: Request,
         user_identifier: str,
         permission: str,
         api_key: str = Form(),
@@ -244,6 +244,7 @@ async def user_set_permission_handler(
 
     await dal.update_user(user=user)
     await dal.commit()
+    await publish_invalidation(request.app.state.redis, user.id)
 
     if key_permission_changed:
         if ENABLE_ENGINE_BOT_WEBHOOK:
@@ -286,6 +287,7 @@ async def user_set_permission_handler(
 
 @router.post("/{user_identifier}/update_password")  # Update password
 async def user_update_password_handler(
+        request: Request,
         user_identifier: str,
         im_id: int = Form(),
         password_hash: str = Form(),
@@ -304,6 +306,7 @@ async def user_update_password_handler(
         user.password_hash = password_hash
         await dal.update_user(user=user)
         await dal.commit()
+        await publish_invalidation(request.app.state.redis, user.id)
         return UserSuccessMessage(
             success="Update password success.",
             type="update",
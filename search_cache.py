@@ -0,0 +1,49 @@
+import hashlib
+import json
+
+from redis.asyncio import Redis
+from redis.commands.core import AsyncScript
+
+from config import SEARCH_RESPONSE_CACHE_TTL
+
+'''
+Shared cache of detailed search pages, without the per-user like / clear data.
+{search_cache}:generation -> counter, bumped to invalidate every cached page at once
+{search_cache}:page:{digest} -> "{generation}\n{page}", expires after SEARCH_RESPONSE_CACHE_TTL
+Pages of an older generation are ignored. The {search_cache} hash tag keeps both keys in one cluster slot.
+'''
+
+GENERATION_KEY: str = "{search_cache}:generation"
+
+# read the generation and the page in one round trip, every key is passed in KEYS
+_get_page_script = AsyncScript(None, b'''
+return {redis.call('GET', KEYS[1]) or '0', redis.call('GET', KEYS[2])}
+''')
+
+
+def _page_key(cache_key: tuple) -> str:
+    return f"{{search_cache}}:page:{hashlib.sha1(repr(cache_key).encode()).hexdigest()}"
+
+
+async def get_page(redis: Redis, cache_key: tuple) -> tuple[int, dict | None]:
+    # returns the current generation and the cached page if any
+    generation, page = await _get_page_script(keys=[GENERATION_KEY, _page_key(cache_key)], client=redis)
+    if page is None:
+        return int(generation), None
+    page_generation, page = page.split(b'\n', 1)
+    if page_generation != generation:
+        return int(generation), None
+    return int(generation), json.loads(page)
+
+
+async def set_page(redis: Redis, cache_key: tuple, generation: int, page: dict):
+    # pages rendered before an invalidation keep their old generation and are never served
+    await redis.set(
+        _page_key(cache_key),
+        f"{generation}\n{json.dumps(page, separators=(',', ':'))}",
+        ex=SEARCH_RESPONSE_CACHE_TTL
+    )
+
+
+async def invalidate(redis: Redis):
+    await redis.incr(GENERATION_KEY)
@@ -1,5 +1,4 @@
 from pydantic import BaseModel as PydanticModel
-import json
 
 
 class Session(PydanticModel):
@@ -11,14 +10,26 @@ class Session(PydanticModel):
     locale: str  # Client locale
     proxied: bool  # Is proxied
 
-    def serialize(self) -> str:
-        return json.dumps(
-            self.model_dump(),
-            separators=(',', ':')
-        )
+    def to_hash(self) -> dict[str, str | int]:
+        # Redis hash fields, the session id is part of the key
+        return {
+            'username': self.username,
+            'user_id': self.user_id,
+            'mobile': int(self.mobile),
+            'client_type': self.client_type,
+            'locale': self.locale,
+            'proxied': int(self.proxied),
+        }
 
 
-def deserialize_session(data: str) -> Session:
-    return Session.model_validate(
-        json.loads(data)
+def session_from_hash(session_id: str, data: dict[bytes, bytes]) -> Session:
+    # sessions are written by us only, so skip validation
+    return Session.model_construct(
+        session_id=session_id,
+        username=data[b'username'].decode(),
+        user_id=int(data[b'user_id']),
+        mobile=data[b'mobile'] == b'1',
+        client_type=int(data[b'client_type']),
+        locale=data[b'locale'].decode(),
+        proxied=data[b'proxied'] == b'1',
     )
@@ -1,18 +1,50 @@
-from session.models import Session, deserialize_session
+from collections import OrderedDict
+from time import monotonic
+import secrets
+
 from redis.asyncio import Redis
-from common import ClientType
-from time import time
+from redis.commands.core import AsyncScript
 
-from locales import get_locale_model
+from session.models import Session, session_from_hash
+from common import ClientType
+from config import SESSION_CACHE_SIZE, SESSION_CACHE_TTL
 
 '''
-session:{session_id} -> Session
+session:{session_id} -> Session hash
 user:{user_id} -> session_id
+Hot sessions are also kept in process for SESSION_CACHE_TTL seconds,
+dropped sessions are announced on the session:invalidate channel.
 '''
 
+INVALIDATE_CHANNEL: str = "session:invalidate"
+SESSION_TTL: int = 60 * 60 * 24  # 1 day
+SESSION_ID_BITS: int = 48  # 12 hex digits, same length class as the old user id + timestamp ids
+
+# KEYS: user:{user_id}, session:{session_id}, session:{previous session_id} if the user had a session
+# ARGV: session_id, ttl, invalidate channel, previous session_id or '', hash fields and values
+# returns {0} if the session id is taken, {2} if another login replaced the previous session meanwhile, otherwise {1}
+_rotate_session_script = AsyncScript(None, b'''
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    return {0}
+end
+if (redis.call('GET', KEYS[1]) or '') ~= ARGV[4] then
+    return {2}
+end
+if KEYS[3] and redis.call('DEL', KEYS[3]) == 1 then
+    redis.call('PUBLISH', ARGV[3], ARGV[4])
+end
+redis.call('HSET', KEYS[2], unpack(ARGV, 5))
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return {1}
+''')
+
+_hot_sessions: OrderedDict[str, tuple[float, Session]] = OrderedDict()  # LRU
+
 
-def generate_session_id(user_id: int):
-    return hex(int(f"{user_id}{str(int(time()))[2:]}")).upper()[2:]
+def generate_session_id() -> str:
+    # random, so ids neither repeat between workers nor can be guessed from the user id and time
+    return f'{secrets.randbits(SESSION_ID_BITS):0{SESSION_ID_BITS // 4}X}'
 
 
 async def new_session(
@@ -25,7 +57,7 @@ async def new_session(
         proxied: bool
 ) -> Session:
     session = Session(
-        session_id=generate_session_id(user_id),
+        session_id=generate_session_id(),
         username=username,
         user_id=user_id,
         mobile=mobile,
@@ -33,22 +65,26 @@ async def new_session(
         locale=locale,
         proxied=proxied
     )
-    # Drop previous session
-    await drop_session_by_id(redis, await get_session_id_by_user_id(redis, user_id))
-    # Add new session
-    async with redis.pipeline(transaction=True) as pipe:
-        await pipe.set(
-            f"session:{session.session_id}",
-            session.serialize(),
-            ex=60 * 60 * 24  # 1 day
-        ).execute()
-    # Add user_id -> session_id
-    async with redis.pipeline(transaction=True) as pipe:
-        await pipe.set(
-            f"user:{user_id}",
-            session.session_id,
-            ex=60 * 60 * 24  # 1 day
-        ).execute()
+    # Replace the previous session atomically, so concurrent logins cannot orphan one;
+    # every key the script touches is passed in KEYS, so the previous session is read first
+    while True:
+        previous: bytes | None = await redis.get(f"user:{user_id}")
+        keys: list[str] = [f"user:{user_id}", f"session:{session.session_id}"]
+        if previous is not None:
+            keys.append(f"session:{previous.decode()}")
+        result = await _rotate_session_script(
+            keys=keys,
+            args=[session.session_id, SESSION_TTL, INVALIDATE_CHANNEL, previous or b'',
+                  *[item for field in session.to_hash().items() for item in field]],
+            client=redis
+        )
+        if result[0] == 1:
+            break
+        if result[0] == 0:
+            # the id is taken by a live session, draw another one
+            session.session_id = generate_session_id()
+    if previous is not None:
+        _hot_sessions.pop(previous.decode(), None)
     return session
 
 
@@ -56,19 +92,34 @@ async def get_session_by_id(
         redis: Redis,
         session_id: str
 ) -> Session | None:
-    session_data = await redis.get(f"session:{session_id}")
-    if session_data is None:
+    item = _hot_sessions.get(session_id)
+    if item is not None:
+        expires, session = item
+        if expires >= monotonic():
+            _hot_sessions.move_to_end(session_id)
+            return session
+        del _hot_sessions[session_id]
+    session_data = await redis.hgetall(f"session:{session_id}")
+    if not session_data:
         return None
-    return deserialize_session(session_data.decode())
+    session = session_from_hash(session_id, session_data)
+    _hot_sessions[session_id] = (monotonic() + SESSION_CACHE_TTL, session)
+    while len(_hot_sessions) > SESSION_CACHE_SIZE:
+        _hot_sessions.popitem(last=False)
+    return session
 
 
 async def drop_session_by_id(
         redis: Redis,
-        session_id: str
+        session_id: str | bytes | None
 ) -> bool:
-    if (await redis.exists(f"session:{session_id}")):
-        async with redis.pipeline(transaction=True) as pipe:
-            await pipe.delete(f"session:{session_id}").execute()
+    if session_id is None:
+        return False
+    if isinstance(session_id, bytes):
+        session_id = session_id.decode()
+    _hot_sessions.pop(session_id, None)
+    if await redis.delete(f"session:{session_id}"):
+        await redis.publish(INVALIDATE_CHANNEL, session_id)
         return True
     else:
         return False
@@ -78,4 +129,16 @@ async def get_session_id_by_user_id(
         redis: Redis,
         user_id: int
 ) -> str | None:
-    return await redis.get(f'user:{user_id}')
+    session_id: bytes | None = await redis.get(f'user:{user_id}')
+    return session_id.decode() if session_id is not None else None
+
+
+async def listen_for_invalidations(redis: Redis):
+    async with redis.pubsub() as pubsub:
+        await pubsub.subscribe(INVALIDATE_CHANNEL)
+        # sessions may have been dropped while we were not subscribed
+        _hot_sessions.clear()
+        async for message in pubsub.listen():
+            if message['type'] != 'message':
+                continue
+            _hot_sessions.pop(message['data'].decode(), None)
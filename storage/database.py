@@ -1,23 +1,64 @@
+from collections import OrderedDict
+from hashlib import sha256
+import zlib
+
 from database.db import Database
 from database.db_access import DBAccessLayer
-from base64 import b64decode, b64encode
+from level_file import PreparedLevel
+from base64 import b64encode
 from loguru import logger
 
+from config import STORAGE_DOWNLOAD_CACHE_SIZE
+
+
+class DownloadCache:
+    # Encoded download payloads (base64 level data + checksum) by level id,
+    # bounded by their total size in bytes
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._payloads: OrderedDict[str, bytes] = OrderedDict()
+
+    def get(self, level_id: str) -> bytes | None:
+        payload = self._payloads.get(level_id)
+        if payload is not None:
+            self._payloads.move_to_end(level_id)
+        return payload
+
+    def set(self, level_id: str, payload: bytes):
+        if len(payload) > self.max_bytes:
+            return
+        self.invalidate(level_id)
+        self._payloads[level_id] = payload
+        self.size += len(payload)
+        while self.size > self.max_bytes:
+            self.size -= len(self._payloads.popitem(last=False)[1])
+
+    def invalidate(self, level_id: str):
+        payload = self._payloads.pop(level_id, None)
+        if payload is not None:
+            self.size -= len(payload)
+
 
 class StorageProviderDatabase:
     def __init__(self, base_url: str, database: Database):
         self.base_url = base_url
         self.db = database
         self.type = "database"
+        self.download_cache = DownloadCache(max_bytes=STORAGE_DOWNLOAD_CACHE_SIZE)
 
-    async def upload_file(self, level_data: str, level_id: str):
+    async def upload_file(self, level_file: PreparedLevel, level_id: str):
+        # level data is stored once per content, compressed
+        raw_data: bytes = level_file.level_data
+        blob_hash: str = sha256(raw_data).hexdigest()
         async with self.db.async_session() as session:
             async with session.begin():
                 dal = DBAccessLayer(session)
+                await dal.add_level_blob(blob_hash=blob_hash, blob_data=zlib.compress(raw_data))
                 await dal.add_level_data(
                     level_id=level_id,
-                    level_data=b64decode(level_data[:-40].encode()).decode(),
-                    level_checksum=level_data[-40:]
+                    blob_hash=blob_hash,
+                    level_checksum=level_file.checksum
                 )
                 await dal.commit()
 
@@ -28,6 +69,7 @@ class StorageProviderDatabase:
         return self.generate_url(level_id=level_id)
 
     async def delete_level(self, level_id: str):
+        self.download_cache.invalidate(level_id)
         async with self.db.async_session() as session:
             async with session.begin():
                 dal = DBAccessLayer(session)
@@ -36,16 +78,25 @@ class StorageProviderDatabase:
                 logger.info(f"Deleted level {level_id} from database")
                 return
 
-    async def dump_level_data(self, level_id: str) -> str | None:
+    async def dump_level_data(self, level_id: str) -> bytes | None:
+        if (payload := self.download_cache.get(level_id)) is not None:
+            return payload
         async with self.db.async_session() as session:
             async with session.begin():
                 dal = DBAccessLayer(session)
                 level = (await dal.dump_level_data(level_id=level_id))
-                if level is not None:
-                    if isinstance(level.level_data, str):
-                        level_data = level.level_data.encode()
-                    else:
-                        level_data = level.level_data
-                    return f'{b64encode(level_data).decode()}{level.level_checksum}'
-                else:
+                if level is None:
                     return None
+                if level.blob_hash is not None:
+                    blob = await dal.get_level_blob(level.blob_hash)
+                    if blob is None:
+                        logger.error(f"Blob {level.blob_hash} of level {level_id} is missing")
+                        return None
+                    level_data = zlib.decompress(blob.blob_data)
+                elif isinstance(level.level_data, str):
+                    level_data = level.level_data.encode()
+                else:
+                    level_data = level.level_data
+        payload: bytes = b64encode(level_data) + level.level_checksum.encode()
+        self.download_cache.set(level_id, payload)
+        return payload
@@ -0,0 +1,72 @@
+import asyncio
+import os
+import re
+
+from loguru import logger
+
+from level_file import PreparedLevel
+
+_level_id_regex = re.compile(r'^[0-9A-F]{4}-[0-9A-F]{4}-[0-9A-F]{4}-[0-9A-F]{4}$')
+
+
+class StorageProviderFilesystem:
+    # Levels are stored as ready to serve .swe files, {path}/{shard}/{shard}/{level_id}.swe
+    def __init__(self, base_url: str, path: str):
+        self.base_url = base_url
+        self.path = path
+        self.type = "filesystem"
+
+    def level_path(self, level_id: str) -> str | None:
+        # None if the level id could not have been generated by us
+        if not _level_id_regex.match(level_id):
+            return None
+        return os.path.join(self.path, level_id[0:2], level_id[2:4], f'{level_id}.swe')
+
+    async def upload_file(self, level_file: PreparedLevel, level_id: str):
+        await asyncio.to_thread(self._write_file, self.level_path(level_id), level_file.payload)
+
+    @staticmethod
+    def _write_file(path: str, content: bytes):
+        # write to a temporary file and rename, so readers never see a partial level
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path: str = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def generate_url(self, level_id: str):
+        return f'{self.base_url}stage/{level_id}/file'
+
+    def generate_download_url(self, level_id: str):
+        return self.generate_url(level_id=level_id)
+
+    async def delete_level(self, level_id: str):
+        path: str | None = self.level_path(level_id)
+        if path is None:
+            return
+        try:
+            await asyncio.to_thread(os.remove, path)
+            logger.info(f"Deleted level {level_id} from filesystem")
+        except FileNotFoundError:
+            pass
+
+    async def dump_level_data(self, level_id: str) -> bytes | None:
+        path: str | None = self.level_path(level_id)
+        if path is None:
+            return None
+        try:
+            return await asyncio.to_thread(self._read_file, path)
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _read_file(path: str) -> bytes:
+        with open(path, 'rb') as f:
+            return f.read()
@@ -2,6 +2,8 @@ import aiohttp
 from urllib.parse import quote
 from loguru import logger
 
+from level_file import PreparedLevel
+
 
 class StorageProviderOneDriveCF:
     def __init__(self, url: str, auth_key: str, proxied: bool):
@@ -11,12 +13,12 @@ class StorageProviderOneDriveCF:
         self.type = "onedrive-cf"
 
     # noinspection PyBroadException
-    async def upload_file(self, level_data: str, level_id: str):
+    async def upload_file(self, level_file: PreparedLevel, level_id: str):
         try:
             async with aiohttp.request(
                     method="POST",
                     url=self.url,
-                    data=level_data,
+                    data=level_file.payload,
                     params={"upload": quote(level_id + ".swe"), "key": self.auth_key},
             ) as r:
                 if (t := await r.text()) != "":
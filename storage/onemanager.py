@@ -4,6 +4,8 @@ from io import BytesIO
 from time import time
 from loguru import logger
 
+from level_file import PreparedLevel
+
 
 class StorageProviderOneManager:
     def __init__(self, url: str, admin_password: str):  # Proxied not supported
@@ -12,11 +14,11 @@ class StorageProviderOneManager:
         self.type = "onemanager"
 
     # noinspection PyBroadException
-    async def upload_file(self, level_data: str, level_id: str):
+    async def upload_file(self, level_file: PreparedLevel, level_id: str):
         logger.info(f'start uploading level {level_id}...')
         postfields = aiohttp.FormData()
         postfields.add_field(name='file1',
-                             value=BytesIO(bytes(level_data, 'ascii')),
+                             value=BytesIO(level_file.payload),
                              content_type='text/plain',
                              filename=level_id + ".swe"
                              )
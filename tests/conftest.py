@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the server runs from the repository root, tests import its modules the same way
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("ENGINETRIBE_CONFIG_PATH", os.path.join(ROOT, "config.yml"))
@@ -0,0 +1,89 @@
+import asyncio
+from hashlib import sha256
+import zlib
+
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from database.db import Base
+from database.db_access import DBAccessLayer
+from database.models import LevelBlob, LevelData
+
+LEVEL_DATA = b'{"objects": [1, 2, 3]}' * 100
+BLOB_HASH = sha256(LEVEL_DATA).hexdigest()
+
+
+async def create_sessionmaker(path=None):
+    # concurrent sessions need a database file, in-memory SQLite shares a single connection
+    engine = create_async_engine(f'sqlite+aiosqlite:///{path}' if path else 'sqlite+aiosqlite://')
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    return async_sessionmaker(engine, expire_on_commit=False)
+
+
+async def upload(async_session, level_id: str, level_data: bytes = LEVEL_DATA):
+    # what StorageProviderDatabase.upload_file does
+    async with async_session() as session:
+        async with session.begin():
+            dal = DBAccessLayer(session)
+            blob_hash: str = sha256(level_data).hexdigest()
+            await dal.add_level_blob(blob_hash=blob_hash, blob_data=zlib.compress(level_data))
+            await dal.add_level_data(level_id=level_id, blob_hash=blob_hash, level_checksum='C' * 40)
+
+
+async def delete(async_session, level_id: str):
+    async with async_session() as session:
+        async with session.begin():
+            await DBAccessLayer(session).delete_level_data(level_id=level_id)
+
+
+async def blob_hashes(async_session) -> list[str]:
+    async with async_session() as session:
+        return (await session.execute(select(LevelBlob.blob_hash).order_by(LevelBlob.blob_hash))).scalars().all()
+
+
+def test_identical_levels_share_one_blob():
+    async def main():
+        async_session = await create_sessionmaker()
+        await upload(async_session, 'AAAA-0000-0000-0000')
+        await upload(async_session, 'BBBB-0000-0000-0000')
+        await upload(async_session, 'CCCC-0000-0000-0000', b'{"objects": []}')
+        assert await blob_hashes(async_session) == sorted([BLOB_HASH, sha256(b'{"objects": []}').hexdigest()])
+        async with async_session() as session:
+            assert (await session.execute(select(func.count()).select_from(LevelData))).scalar() == 3
+            blob = await DBAccessLayer(session).get_level_blob(BLOB_HASH)
+            assert zlib.decompress(blob.blob_data) == LEVEL_DATA
+
+    asyncio.run(main())
+
+
+def test_blob_is_dropped_with_its_last_level():
+    async def main():
+        async_session = await create_sessionmaker()
+        await upload(async_session, 'AAAA-0000-0000-0000')
+        await upload(async_session, 'BBBB-0000-0000-0000')
+        await delete(async_session, 'AAAA-0000-0000-0000')
+        assert await blob_hashes(async_session) == [BLOB_HASH]
+        await delete(async_session, 'BBBB-0000-0000-0000')
+        assert await blob_hashes(async_session) == []
+        # uploaded again after its blob was dropped
+        await upload(async_session, 'AAAA-0000-0000-0000')
+        assert await blob_hashes(async_session) == [BLOB_HASH]
+
+    asyncio.run(main())
+
+
+def test_concurrent_uploads_and_deletes_keep_referenced_blobs(tmp_path):
+    async def main():
+        async_session = await create_sessionmaker(tmp_path / 'blobs.db')
+        await upload(async_session, 'AAAA-0000-0000-0000')
+        await asyncio.gather(
+            delete(async_session, 'AAAA-0000-0000-0000'),
+            *[upload(async_session, f'{n:04d}-0000-0000-0000') for n in range(5)]
+        )
+        assert await blob_hashes(async_session) == [BLOB_HASH]
+        for n in range(5):
+            await delete(async_session, f'{n:04d}-0000-0000-0000')
+        assert await blob_hashes(async_session) == []
+
+    asyncio.run(main())
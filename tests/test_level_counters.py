@@ -0,0 +1,107 @@
+import asyncio
+
+from sqlalchemy import insert, select
+from sqlalchemy.dialects import mysql
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from database.db import Base
+from database.counters import LevelCounterBuffer, counter_update_statement
+from database.difficulty import difficulty_bucket
+from database.models import Level, User
+
+
+class CounterDatabase:
+    # the parts of database.db.Database the counter buffer uses
+    def __init__(self):
+        self.engine = create_async_engine('sqlite+aiosqlite://')
+        self.async_session = async_sessionmaker(self.engine, expire_on_commit=False)
+
+    async def create(self, levels: list[dict]):
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.execute(insert(User), [{'id': 1, 'username': 'author'}])
+            await conn.execute(insert(Level), [{
+                'name': f'Level {level["id"]}', 'likes': 0, 'dislikes': 0, 'plays': 0, 'deaths': 0, 'clears': 0,
+                'style': 0, 'environment': 0, 'tag_1': 0, 'tag_2': 0, 'description': '', 'author_id': 1,
+                'level_id': f'{level["id"]:04d}-0000-0000-0000', 'non_latin': False, 'featured': False,
+                'record_user_id': 0, 'record': 0, 'testing_client': False, **level
+            } for level in levels])
+
+    async def counters(self, level_pk: int) -> dict[str, int]:
+        async with self.async_session() as session:
+            level = (await session.execute(select(Level).where(Level.id == level_pk))).scalars().one()
+            return {counter: getattr(level, counter) for counter in ('plays', 'deaths', 'clears', 'likes', 'dislikes')}
+
+
+def test_flush_applies_buffered_hits_once():
+    async def main():
+        db = CounterDatabase()
+        await db.create([{'id': 1, 'plays': 10, 'deaths': 3}, {'id': 2}])
+        counters = LevelCounterBuffer()
+        for _ in range(5):
+            counters.add(1, 'plays')
+            counters.add(1, 'deaths', 2)
+        counters.add(2, 'dislikes')
+        assert len(counters) == 2
+        await counters.flush(db)
+        assert len(counters) == 0
+        assert await db.counters(1) == {'plays': 15, 'deaths': 13, 'clears': 0, 'likes': 0, 'dislikes': 0}
+        assert await db.counters(2) == {'plays': 0, 'deaths': 0, 'clears': 0, 'likes': 0, 'dislikes': 1}
+        # nothing buffered since, a second flush changes nothing
+        assert await counters.flush(db) == []
+        assert await db.counters(1) == {'plays': 15, 'deaths': 13, 'clears': 0, 'likes': 0, 'dislikes': 0}
+
+    asyncio.run(main())
+
+
+def test_milestones_are_pushed_exactly_once():
+    async def main():
+        db = CounterDatabase()
+        await db.create([{'id': 1, 'plays': 95, 'likes': 999}, {'id': 2, 'dislikes': 99}])
+        counters = LevelCounterBuffer()
+        for _ in range(10):
+            counters.add(1, 'plays')
+        counters.add(1, 'likes')
+        counters.add(2, 'dislikes')
+        milestones = await counters.flush(db)
+        assert sorted((m.level_id, m.counter, m.value) for m in milestones) == [
+            ('0001-0000-0000-0000', 'likes', 1000), ('0001-0000-0000-0000', 'plays', 100)
+        ]
+        assert {m.author_name for m in milestones} == {'author'}
+        assert {m.level_name for m in milestones} == {'Level 1'}
+        # already past 100 plays and 1000 likes, later flushes cross nothing
+        for _ in range(10):
+            counters.add(1, 'plays')
+        counters.add(1, 'likes')
+        assert await counters.flush(db) == []
+        assert await counters.flush(db) == []
+        assert (await db.counters(1))['plays'] == 115
+
+    asyncio.run(main())
+
+
+def test_flush_recomputes_the_difficulty_bucket():
+    async def main():
+        db = CounterDatabase()
+        await db.create([{'id': 1, 'plays': 10, 'clears': 1}, {'id': 2}])
+        counters = LevelCounterBuffer()
+        # 20 plays, 4 clears: 20% is easy, adding the deltas twice (40 plays, 7 clears) would be normal
+        for _ in range(10):
+            counters.add(1, 'plays')
+        for _ in range(3):
+            counters.add(1, 'clears')
+        counters.add(2, 'plays')
+        await counters.flush(db)
+        async with db.async_session() as session:
+            difficulties = dict((await session.execute(select(Level.id, Level.difficulty))).all())
+        assert difficulties == {1: difficulty_bucket(20, 4), 2: difficulty_bucket(1, 0)} == {1: 0, 2: 3}
+
+    asyncio.run(main())
+
+
+def test_difficulty_is_assigned_before_the_counters_on_mysql():
+    # MySQL evaluates SET left to right, the bucket must be computed from the columns before the update
+    compiled = str(counter_update_statement().compile(dialect=mysql.dialect()))
+    assignments = compiled.split(' SET ')[1].split(' WHERE ')[0]
+    assert assignments.startswith('difficulty=')
+    assert assignments.index('difficulty=') < assignments.index('plays=') < assignments.index('clears=')
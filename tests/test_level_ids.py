@@ -0,0 +1,43 @@
+import asyncio
+import base64
+import json
+import os
+
+import pytest
+
+from ingest import LevelIngestPool
+from level_file import prepare_level
+
+# .swe files with the md5, sha1 and sha256 level ids the original upload handler generated for them
+# (base64-decoding the whole .swe, dropping the 30 checksum bytes and blanking "time" and "date").
+# A changed id would orphan every existing level, so these must never be regenerated with new code.
+with open(os.path.join(os.path.dirname(__file__), 'fixtures', 'level_ids.json'), encoding='utf-8') as f:
+    CASES: list[dict] = json.load(f)
+
+
+@pytest.mark.parametrize('case', CASES, ids=[case['description'] for case in CASES])
+def test_level_ids_match_the_original_algorithm(case):
+    level_file = prepare_level(case['swe'])
+    assert list(level_file.level_ids) == case['level_ids']
+    assert level_file.checksum == case['swe'][-40:]
+    assert base64.b64encode(level_file.level_data).decode() == case['swe'][:-40]
+
+
+def test_saving_time_and_date_do_not_change_the_level_id():
+    first, second = CASES[0], CASES[1]
+    assert first['swe'] != second['swe']
+    assert prepare_level(first['swe']).level_ids == prepare_level(second['swe']).level_ids
+
+
+def test_ingest_workers_generate_the_same_level_ids():
+    async def main():
+        pool = LevelIngestPool(workers=2, max_queue=len(CASES))
+        pool.start()
+        try:
+            return await asyncio.gather(*[pool.prepare_level(case['swe']) for case in CASES])
+        finally:
+            pool.shutdown()
+
+    for case, level_file in zip(CASES, asyncio.run(main())):
+        assert list(level_file.level_ids) == case['level_ids']
+        assert level_file.payload == case['swe'].encode()
@@ -0,0 +1,47 @@
+import asyncio
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from database.db import Base
+from database.db_access import DBAccessLayer
+from database.models import Level
+import metrics
+
+LEVEL_ID = '0001-0000-0000-0000'
+
+
+def test_level_names_are_queried_once_per_level():
+    async def main():
+        engine = create_async_engine('sqlite+aiosqlite://')
+        metrics.instrument_engine(engine)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.execute(insert(Level), [{
+                'id': 1, 'name': 'Level 1', 'likes': 0, 'dislikes': 0, 'plays': 0, 'deaths': 0, 'clears': 0,
+                'style': 0, 'environment': 0, 'tag_1': 0, 'tag_2': 0, 'description': '', 'author_id': 1,
+                'level_id': LEVEL_ID, 'non_latin': False, 'featured': False, 'record_user_id': 0,
+                'record': 0, 'testing_client': False
+            }])
+        async_session = async_sessionmaker(engine, expire_on_commit=False)
+
+        async def download() -> tuple[str | None, int]:
+            # level name and queries of one download
+            request_metrics = metrics.RequestMetrics()
+            token = metrics.current_request.set(request_metrics)
+            try:
+                async with async_session() as session:
+                    async with session.begin():
+                        return await DBAccessLayer(session).get_level_name(LEVEL_ID), request_metrics.db_queries
+            finally:
+                metrics.current_request.reset(token)
+
+        assert await download() == ('Level 1', 1)
+        assert await download() == ('Level 1', 0)
+        async with async_session() as session:
+            async with session.begin():
+                dal = DBAccessLayer(session)
+                await dal.delete_level(await dal.get_level_by_level_id(LEVEL_ID))
+        assert await download() == (None, 1)
+
+    asyncio.run(main())
@@ -0,0 +1,44 @@
+import datetime
+import json
+
+from common import level_to_fragment, detailed_search_response, single_level_response
+from database.db_access import LevelHydration
+from database.models import Level
+from models import DetailedSearchResults, SingleLevelDetails
+
+
+def make_level(pk: int, **columns) -> Level:
+    values = dict(
+        id=pk, name=f'Nivel {pk} ñandú', likes=3, dislikes=1, plays=10, deaths=4, clears=2, style=1,
+        environment=0, tag_1=2, tag_2=3, description='', date=datetime.date(2024, 5, 17), author_id=7,
+        level_id=f'ABCD-0000-0000-{pk:04X}', non_latin=False, name_latin=None, featured=pk % 2 == 0,
+        record_user_id=8, record=12345, testing_client=False, difficulty=None
+    )
+    values.update(columns)
+    return Level(**values)
+
+
+def render_rows(levels: list[Level]) -> list[bytes]:
+    hydration = LevelHydration(usernames={7: 'autor', 8: 'récord'}, like_types={1: '0'}, clear_types={2: 'yes'})
+    return [
+        level_to_fragment(
+            level_data=level, locale='ES', level_file_url=f'http://x/stage/{level.level_id}/file', mobile=False,
+            hydration=hydration
+        ).render(completed=hydration.clear_type(level.id), liked=hydration.like_type(level.id))
+        for level in levels
+    ]
+
+
+def test_detailed_search_matches_model():
+    rows = render_rows([make_level(1), make_level(2, record_user_id=0, record=0, description='hola "mundo"')])
+    body: bytes = detailed_search_response(
+        num_rows=2, rows_perpage=10, pages=1, rows=rows, next_cursor='abc'
+    ).body
+    # the fast encoder writes exactly what the documented model would serialize
+    assert DetailedSearchResults.model_validate_json(body).model_dump_json().encode() == body
+    assert json.loads(body)['result'][1]['record'] == {'record': 'no'}
+
+
+def test_single_level_matches_model():
+    body: bytes = single_level_response(search_type='id', row=render_rows([make_level(3)])[0]).body
+    assert SingleLevelDetails.model_validate_json(body).model_dump_json().encode() == body
@@ -0,0 +1,89 @@
+import asyncio
+
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from database.db import Base
+from database.models import Level
+from database.pagination import (
+    LevelOrdering,
+    PageCursorCache,
+    order_levels,
+    seek_levels,
+    level_sort_key,
+    encode_cursor,
+    decode_cursor
+)
+
+LEVELS = 47
+PAGE_SIZE = 10
+
+
+async def create_levels():
+    engine = create_async_engine('sqlite+aiosqlite://')
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        # few distinct scores, so most pages end in the middle of a tie
+        await conn.execute(insert(Level), [{
+            'id': n, 'name': f'Level {n}', 'likes': n % 4, 'dislikes': n % 3, 'plays': 0, 'deaths': 0, 'clears': 0,
+            'style': 0, 'environment': 0, 'tag_1': 0, 'tag_2': 0, 'description': '', 'author_id': 1,
+            'level_id': f'{n:04d}-0000-0000-0000', 'non_latin': False, 'featured': False, 'record_user_id': 0,
+            'record': 0, 'testing_client': False
+        } for n in range(1, LEVELS + 1)])
+    return async_sessionmaker(engine, expire_on_commit=False)
+
+
+async def fetch_page(session, ordering: LevelOrdering, cursor: str | None, page: int = 1) -> list[Level]:
+    selection = order_levels(select(Level), ordering)
+    if cursor is not None:
+        selection = seek_levels(selection, ordering, decode_cursor(cursor, ordering))
+    else:
+        selection = selection.offset((page - 1) * PAGE_SIZE)
+    return (await session.execute(selection.limit(PAGE_SIZE))).scalars().all()
+
+
+def test_cursors_page_through_ties_without_gaps_or_duplicates():
+    async def main():
+        async_session = await create_levels()
+        async with async_session() as session:
+            for ordering in LevelOrdering:
+                expected = [level.id for level in (await session.execute(
+                    order_levels(select(Level), ordering)
+                )).scalars().all()]
+                seen: list[int] = []
+                cursor: str | None = None
+                while levels := await fetch_page(session, ordering, cursor):
+                    seen += [level.id for level in levels]
+                    cursor = encode_cursor(ordering, level_sort_key(levels[-1], ordering))
+                assert seen == expected, ordering
+
+    asyncio.run(main())
+
+
+def test_page_numbers_translate_to_the_same_pages_as_offsets():
+    async def main():
+        async_session = await create_levels()
+        page_cursors = PageCursorCache(max_size=100, ttl=60)
+        query_key = ('popular',)
+        ordering = LevelOrdering.POPULAR
+        async with async_session() as session:
+            for page in range(1, LEVELS // PAGE_SIZE + 2):
+                # what the search handler does for a legacy page number
+                page_cursor = page_cursors.get(query_key, page)
+                assert (page_cursor is None) == (page == 1)
+                levels = await fetch_page(session, ordering, page_cursor, page)
+                by_offset = await fetch_page(session, ordering, None, page)
+                assert [level.id for level in levels] == [level.id for level in by_offset]
+                if len(levels) == PAGE_SIZE:
+                    page_cursors.set(query_key, page + 1, encode_cursor(ordering, level_sort_key(levels[-1], ordering)))
+
+    asyncio.run(main())
+
+
+def test_malformed_or_foreign_cursors_are_rejected():
+    cursor = encode_cursor(LevelOrdering.POPULAR, [3, 12])
+    assert decode_cursor(cursor, LevelOrdering.POPULAR) == [3, 12]
+    assert decode_cursor(cursor, LevelOrdering.LATEST) is None
+    assert decode_cursor(encode_cursor(LevelOrdering.LATEST, [12]), LevelOrdering.POPULAR) is None
+    assert decode_cursor('not a cursor', LevelOrdering.LATEST) is None
+    assert decode_cursor(encode_cursor(LevelOrdering.LATEST, ['12']), LevelOrdering.LATEST) is None
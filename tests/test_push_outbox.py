@@ -0,0 +1,131 @@
+import asyncio
+
+from sqlalchemy import update
+
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from database.db import Base
+from database.models import PushEvent
+from database.outbox import PushOutbox
+
+TARGET = 'http://engine_bot/enginetribe'
+
+
+class OutboxDatabase:
+    # the parts of database.db.Database the outbox uses, on a SQLite file shared by all "workers"
+    def __init__(self, path):
+        self.engine = create_async_engine(f'sqlite+aiosqlite:///{path}')
+        self.async_session = async_sessionmaker(self.engine, expire_on_commit=False)
+
+    async def create(self):
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+
+async def start_workers(db: OutboxDatabase, count: int, targets: list[str]) -> list[PushOutbox]:
+    workers = []
+    for n in range(count):
+        outbox = PushOutbox(limit=30)
+        outbox.worker_id = f'worker-{n}'
+        await outbox.load(db, targets)
+        workers.append(outbox)
+    return workers
+
+
+def test_workers_never_claim_the_same_event(tmp_path):
+    async def main():
+        db = OutboxDatabase(tmp_path / 'outbox.db')
+        await db.create()
+        workers = await start_workers(db, 3, [TARGET])
+        for i in range(25):
+            await workers[i % 3].add([TARGET], {'i': i})
+        delivered: list[int] = []
+
+        async def deliver(outbox: PushOutbox):
+            while events := await outbox.fetch(TARGET, 4):
+                delivered.extend(event.payload['i'] for event in events)
+                await asyncio.sleep(0)
+                await outbox.remove(TARGET, events)
+
+        await asyncio.gather(*[deliver(outbox) for outbox in workers])
+        assert sorted(delivered) == list(range(25))
+
+    asyncio.run(main())
+
+
+def test_only_the_claiming_worker_removes_events(tmp_path):
+    async def main():
+        db = OutboxDatabase(tmp_path / 'outbox.db')
+        await db.create()
+        first, second = await start_workers(db, 2, [TARGET])
+        await first.add([TARGET], {'i': 0})
+        events = await first.fetch(TARGET, 10)
+        assert await second.fetch(TARGET, 10) == []
+        await second.remove(TARGET, events)
+        assert second.depth[TARGET] == 1
+        await first.remove(TARGET, events)
+        assert first.depth[TARGET] == 0
+
+    asyncio.run(main())
+
+
+def test_limit_holds_across_workers(tmp_path):
+    async def main():
+        db = OutboxDatabase(tmp_path / 'outbox.db')
+        await db.create()
+        workers = await start_workers(db, 2, [TARGET])
+        for i in range(40):
+            await workers[i % 2].add([TARGET], {'i': i}, merge_key=f'100_plays:{i}')
+        await workers[0].fetch(TARGET, 0)
+        assert workers[0].depth[TARGET] == 30
+
+    asyncio.run(main())
+
+
+def test_limit_holds_for_concurrent_adds(tmp_path):
+    async def main():
+        db = OutboxDatabase(tmp_path / 'outbox.db')
+        await db.create()
+        workers = await start_workers(db, 3, [TARGET])
+        await asyncio.gather(*[workers[i % 3].add([TARGET], {'i': i}) for i in range(45)])
+        await workers[0].fetch(TARGET, 0)
+        assert workers[0].depth[TARGET] == 30
+        assert workers[0].dropped + workers[1].dropped + workers[2].dropped == 15
+
+    asyncio.run(main())
+
+
+def test_renewed_claims_are_not_taken_over(tmp_path):
+    async def main():
+        db = OutboxDatabase(tmp_path / 'outbox.db')
+        await db.create()
+        first, second = await start_workers(db, 2, [TARGET])
+        await first.add([TARGET], {'i': 0})
+        await first.add([TARGET], {'i': 1})
+        events = await first.fetch(TARGET, 10)
+
+        async def expire_claims():
+            async with db.async_session() as session:
+                async with session.begin():
+                    await session.execute(update(PushEvent).values(claimed_until=0))
+
+        await expire_claims()
+        await first.renew(events)
+        assert await second.fetch(TARGET, 10) == []
+        # a claim that was not renewed in time is delivered by another worker
+        await expire_claims()
+        assert [event.payload['i'] for event in await second.fetch(TARGET, 10)] == [0, 1]
+
+    asyncio.run(main())
+
+
+def test_load_without_targets_keeps_pending_events(tmp_path):
+    async def main():
+        db = OutboxDatabase(tmp_path / 'outbox.db')
+        await db.create()
+        worker, = await start_workers(db, 1, [TARGET])
+        await worker.add([TARGET], {'i': 0})
+        restarted, = await start_workers(db, 1, [])
+        assert restarted.depth == {TARGET: 1}
+
+    asyncio.run(main())
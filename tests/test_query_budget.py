@@ -0,0 +1,83 @@
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Depends
+from fastapi.testclient import TestClient
+import pytest
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from database.db import Base
+from database.models import User
+import metrics
+
+engine = create_async_engine('sqlite+aiosqlite://')
+metrics.instrument_engine(engine)
+async_session = async_sessionmaker(engine, expire_on_commit=False)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(metrics.MetricsMiddleware)
+
+
+async def create_session():
+    async with async_session() as session:
+        async with session.begin():
+            yield session
+
+
+@app.get('/users/{count}')
+async def get_users_one_by_one(count: int, session=Depends(create_session)):
+    # the N+1 pattern the budget is there to catch
+    for user_id in range(count):
+        await session.execute(select(User).where(User.id == user_id))
+    return {'count': count}
+
+
+@app.post('/users/{count}')
+async def add_users(count: int, session=Depends(create_session)):
+    await session.execute(insert(User), [{'username': f'user{n}'} for n in range(count)])
+    await session.execute(update(User).values(uploads=0))
+    return {'count': count}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(metrics, 'DATABASE_DEBUG_HEADERS', True)
+    monkeypatch.setattr(metrics, 'DATABASE_QUERY_BUDGET', 50)
+    monkeypatch.setattr(metrics, 'DATABASE_REPEAT_LIMIT', 10)
+    monkeypatch.setattr(metrics, 'DATABASE_STRICT_QUERY_BUDGET', False)
+    with TestClient(app) as client:
+        yield client
+
+
+def test_repeated_statements_are_only_reported(client):
+    response = client.get('/users/12')
+    assert response.status_code == 200
+    assert response.headers['x-db-repeats'] == '12'
+
+
+def test_strict_mode_fails_repeated_statements(client, monkeypatch):
+    monkeypatch.setattr(metrics, 'DATABASE_STRICT_QUERY_BUDGET', True)
+    with pytest.raises(metrics.QueryBudgetExceeded, match='N\\+1'):
+        client.get('/users/12')
+    assert client.get('/users/5').status_code == 200
+
+
+def test_strict_mode_fails_requests_over_budget(client, monkeypatch):
+    monkeypatch.setattr(metrics, 'DATABASE_STRICT_QUERY_BUDGET', True)
+    monkeypatch.setattr(metrics, 'DATABASE_REPEAT_LIMIT', 0)
+    with pytest.raises(metrics.QueryBudgetExceeded, match='budget is 50'):
+        client.get('/users/60')
+
+
+def test_rows_count_changed_rows(client):
+    response = client.post('/users/3')
+    assert response.headers['x-db-rows'] == '6'
+    assert client.get('/users/3').headers['x-db-rows'] == '0'
@@ -0,0 +1,70 @@
+import asyncio
+
+import fakeredis
+
+from common import ClientType
+from session import session_access
+
+
+def login(redis, user_id: int):
+    return session_access.new_session(
+        redis, username=f'user{user_id}', user_id=user_id, mobile=False, client_type=ClientType.STABLE,
+        locale='ES', proxied=False
+    )
+
+
+async def session_keys(redis) -> set[str]:
+    return {key.decode().removeprefix('session:') for key in await redis.keys('session:*')}
+
+
+def test_parallel_logins_leave_one_session_per_user():
+    async def main():
+        redis = fakeredis.FakeAsyncRedis(max_connections=1000)
+        users = range(20)
+        sessions = await asyncio.gather(*[login(redis, user_id) for user_id in users for _ in range(25)])
+        assert len({session.session_id for session in sessions}) == len(sessions)
+        # every user ends up with exactly the session its user:{id} mapping points to, nothing orphaned
+        current = {(await session_access.get_session_id_by_user_id(redis, user_id)) for user_id in users}
+        assert await session_keys(redis) == current
+        assert len(current) == len(users)
+        for session_id in current:
+            session = await session_access.get_session_by_id(redis, session_id)
+            assert session is not None and session.session_id == session_id
+            assert await redis.ttl(f'session:{session_id}') > 0
+
+    asyncio.run(main())
+
+
+def test_login_drops_previous_session():
+    async def main():
+        redis = fakeredis.FakeAsyncRedis()
+        first = await login(redis, 1)
+        assert await session_access.get_session_by_id(redis, first.session_id) is not None
+        second = await login(redis, 1)
+        assert await session_access.get_session_by_id(redis, first.session_id) is None
+        assert await session_keys(redis) == {second.session_id}
+
+    asyncio.run(main())
+
+
+def test_session_ids_are_unique_and_fixed_length():
+    count = 10 ** 6
+    ids = {session_access.generate_session_id() for _ in range(count)}
+    # 48 random bits: a repeat among a million ids has a 0.2% chance, two have about 1 in a million;
+    # new_session draws another id when one is taken by a live session
+    assert len(ids) >= count - 1
+    assert {len(session_id) for session_id in ids} == {session_access.SESSION_ID_BITS // 4}
+    assert all(int(session_id, 16) >= 0 for session_id in list(ids)[:1000])
+
+
+def test_taken_session_id_is_drawn_again(monkeypatch):
+    async def main():
+        redis = fakeredis.FakeAsyncRedis()
+        ids = iter(['AAAAAAAAAAAA', 'AAAAAAAAAAAA', 'BBBBBBBBBBBB'])
+        monkeypatch.setattr(session_access, 'generate_session_id', lambda: next(ids))
+        first = await login(redis, 1)
+        second = await login(redis, 2)
+        assert (first.session_id, second.session_id) == ('AAAAAAAAAAAA', 'BBBBBBBBBBBB')
+        assert (await session_access.get_session_by_id(redis, 'AAAAAAAAAAAA')).user_id == 1
+
+    asyncio.run(main())
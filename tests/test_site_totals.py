@@ -0,0 +1,53 @@
+import asyncio
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from database.db import Base
+from database.db_access import DBAccessLayer
+from database.models import LevelBlob
+from database.totals import site_totals
+
+
+async def create_sessionmaker():
+    engine = create_async_engine('sqlite+aiosqlite://')
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    site_totals.players = site_totals.levels = 0
+    return async_sessionmaker(engine, expire_on_commit=False)
+
+
+def test_totals_change_when_the_transaction_commits():
+    async def main():
+        async_session = await create_sessionmaker()
+        async with async_session() as session:
+            async with session.begin():
+                await DBAccessLayer(session).add_user('user', 'hash', 1)
+                assert site_totals.players == 0
+            assert site_totals.players == 1
+        async with async_session() as session:
+            await DBAccessLayer(session).add_user('rolled back', 'hash', 2)
+            await session.rollback()
+        assert site_totals.players == 1
+
+    asyncio.run(main())
+
+
+def test_savepoints_wait_for_the_outer_transaction():
+    async def main():
+        async_session = await create_sessionmaker()
+        async with async_session() as session:
+            async with session.begin():
+                await DBAccessLayer(session).add_user('user', 'hash', 1)
+                session.add(LevelBlob(blob_hash='blob', blob_data=b''))
+                try:
+                    async with session.begin_nested():
+                        session.add(LevelBlob(blob_hash='blob', blob_data=b''))
+                except IntegrityError:
+                    pass
+                async with session.begin_nested():
+                    await DBAccessLayer(session).add_user('other user', 'hash', 2)
+                assert site_totals.players == 0
+            assert site_totals.players == 2
+
+    asyncio.run(main())